@@ -1,42 +1,158 @@
-# Parallely simulates the vegetation automaton
-# And stores the entire data inside automaton_data folder
+# Parallely simulates the vegetation automaton on all cores
+# And streams the entire data into the automaton_data folder
 
-from concurrent.futures import ThreadPoolExecutor
-from itertools import product
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from math import sqrt
-from numba import njit
-from numpy import copy, sum, zeros
-from matplotlib import pyplot as plt
-from random import random
+from numba import njit, prange
+from numpy import array, int64, mean, std, sum, zeros
+from numpy.random import SeedSequence
+from time import perf_counter
+import os
 
-from data_manager import save_automaton_data
+from cluster_tracking import add_cell, remove_cell
+from cluster_statistics import obtain_observables
+from data_manager import finish_run, get_checkpoint_numbers, get_simulation_path, load_checkpoint, register_run, save_checkpoint
+from density import make_density_field, make_density_field_fft, make_kernel_fft, make_normalization, make_stencil, update_density_field
+from lattice import make_random_lattice
+from metrics import emit_metrics, enable_metrics, get_metrics_path, metrics_enabled
+from observers import EquilibrationObserver, ForestCoverObserver, SnapshotObserver, TrajectoryObserver
+from power_law import fit_probabilities, get_lattice_probabilities
+from rng import draw_seed, get_child_seed, get_stream
 
+default_parameters = {
+    # simulation parameters
+    "mc_steps": 200,
+    "mc_fraction": 0.2,
+
+    # constants
+    "n": 500,
+    "rainfall": 500,
+    "r_influence": 6,
+    "immediacy": 24,
+}
 
-@njit(fastmath=True, nogil=False)
-def mc_step(lattice):
-    """ Simulates a single Monte Carlo step of the automaton """
-    n = len(lattice)
-    f_current = sum(lattice) / (n * n)
-    num_updates = int(mc_fraction * n * n)
 
-    for _ in range(num_updates):
-        i = int(random() * n)
-        j = int(random() * n)
-        rho = get_density(lattice, i, j)
+@njit(fastmath=True, nogil=True, cache=True)
+def update_region(lattice, density, normalization, offsets, weights, f_carrying, f_current, uniforms, i0, j0, height,
+                  width, tracker, counters):
+    """ Updates cells of the region [i0, i0 + height) x [j0, j0 + width), one per row of the (num_updates, 3) uniforms,
+    which selects the cell and decides its growth (or decay) """
+    for k in range(len(uniforms)):
+        i = i0 + int(uniforms[k, 0] * height)
+        j = j0 + int(uniforms[k, 1] * width)
+        rho = density[i, j] / normalization[i, j]
 
         if lattice[i, j] == 0:
             prob_growth = rho + (f_carrying - f_current) / (1 - f_current)
-            if random() < prob_growth:
+            if counters is not None:
+                counters[0] += 1
+            if uniforms[k, 2] < prob_growth:
                 lattice[i, j] = 1
+                update_density_field(density, i, j, 1, offsets, weights)
+                if tracker is not None:
+                    add_cell(lattice, tracker, i, j)
+                if counters is not None:
+                    counters[1] += 1
         else:
             prob_decay = (1 - rho) + (f_current - f_carrying) / f_current
-            if random() < prob_decay:
+            if counters is not None:
+                counters[2] += 1
+            if uniforms[k, 2] < prob_decay:
                 lattice[i, j] = 0
+                update_density_field(density, i, j, -1, offsets, weights)
+                if tracker is not None:
+                    remove_cell(lattice, tracker, i, j)
+                if counters is not None:
+                    counters[3] += 1
+
+
+@njit(fastmath=True, nogil=True, cache=True)
+def mc_step(lattice, density, normalization, offsets, weights, f_carrying, uniforms, tracker=None, counters=None):
+    """ Simulates a single Monte Carlo step of the automaton, updating the cluster tracker (if any) on every flip
+    Every row of the (num_updates, 3) uniforms selects a cell (i, j) and decides its update
+    If counters is given, the growth proposals, growths, decay proposals and decays are added to its 4 elements """
+    n = len(lattice)
+    f_current = sum(lattice) / (n * n)
+    update_region(lattice, density, normalization, offsets, weights, f_carrying, f_current, uniforms, 0, 0, n, n,
+                  tracker, counters)
+
+
+@njit(fastmath=True, parallel=True, cache=True)
+def mc_step_phase(lattice, density, normalization, offsets, weights, f_carrying, f_current, tiles, uniforms, counters):
+    """ Updates all tiles of one colour concurrently, every tile (i0, j0, height, width, first, count) drawing its
+    cells from its own rows uniforms[first:first + count] and counting its flips in its own row of counters """
+    for t in prange(len(tiles)):
+        i0, j0, height, width, first, count = tiles[t]
+        update_region(lattice, density, normalization, offsets, weights, f_carrying, f_current,
+                      uniforms[first:first + count], i0, j0, height, width, None, counters[t])
+
+
+def make_tile_schedule(n, r_influence, mc_fraction, tile_size=64):
+    """ Splits the lattice into square tiles, coloured like a 2 x 2 checkerboard, and returns the tiles of every colour
+    A flip changes the density up to r_influence away, so tiles of the same colour (separated by a whole tile)
+    never touch the same part of the density field as long as tiles are at least 2 r_influence wide """
+    tile_size = max(tile_size, 2 * r_influence)
+    num_tiles = -(-n // tile_size)
+
+    schedule = []
+    for colour in range(4):
+        tiles = []
+        first = 0
+        for ti in range(colour // 2, num_tiles, 2):
+            for tj in range(colour % 2, num_tiles, 2):
+                height = min(tile_size, n - ti * tile_size)
+                width = min(tile_size, n - tj * tile_size)
+                count = int(mc_fraction * height * width)
+                tiles.append((ti * tile_size, tj * tile_size, height, width, first, count))
+                first += count
+        schedule.append(array(tiles, dtype=int64).reshape(-1, 6))
+    return schedule
+
+
+def mc_step_tiled(lattice, density, normalization, offsets, weights, f_carrying, schedule, stream, counters=None):
+    """ Simulates a single Monte Carlo step in four phases, one per tile colour, each updating its tiles in parallel
+    The forest cover is recomputed between phases, so every phase sees the flips of the previous ones """
+    n = len(lattice)
+
+    for tiles in schedule:
+        if len(tiles) == 0:
+            continue
+        f_current = sum(lattice) / (n * n)
+        uniforms = stream.random((tiles[-1, 4] + tiles[-1, 5], 3))
+        tile_counters = zeros((len(tiles), 4), dtype=int64)
+        mc_step_phase(lattice, density, normalization, offsets, weights, f_carrying, f_current, tiles, uniforms,
+                      tile_counters)
+
+        if counters is not None:
+            counters += tile_counters.sum(axis=0)
+
+
+def mc_step_synchronous(lattice, kernel_fft, normalization, f_carrying, mc_fraction, stream, counters=None):
+    """ Simulates a single Monte Carlo step in which a random mc_fraction of cells is updated simultaneously
+    If counters is given, the growth proposals, growths, decay proposals and decays are added to its 4 elements """
+    n = len(lattice)
+    f_current = sum(lattice) / (n * n)
+
+    # every selected cell sees the densities at the beginning of the step
+    rho = make_density_field_fft(lattice, kernel_fft) / normalization
+    selected = stream.random((n, n)) < mc_fraction
+    draws = stream.random((n, n))
+
+    prob_growth = rho + (f_carrying - f_current) / (1 - f_current)
+    prob_decay = (1 - rho) + (f_current - f_carrying) / f_current
+    grows = selected & (lattice == 0) & (draws < prob_growth)
+    decays = selected & (lattice == 1) & (draws < prob_decay)
 
+    if counters is not None:
+        counters += [sum(selected & (lattice == 0)), sum(grows), sum(selected & (lattice == 1)), sum(decays)]
 
-@njit(fastmath=True, nogil=False)
-def get_density(lattice, i, j):
-    """ Calculates the vegetation density in the neighbourhood of a given cell (i, j) """
+    lattice[grows] = 1
+    lattice[decays] = 0
+
+
+@njit(fastmath=True, nogil=True, cache=True)
+def get_density(lattice, i, j, r_influence, immediacy):
+    """ Calculates the vegetation density in the neighbourhood of a given cell (i, j) from scratch """
     n = len(lattice)
     normalization = 0
     density = 0
@@ -50,18 +166,17 @@ def get_density(lattice, i, j):
     return density / normalization
 
 
-@njit(fastmath=True, nogil=True)
+@njit(fastmath=True, nogil=True, cache=True)
 def get_distance(i, j, a, b):
     """ Calculates the distance between two cells at locations (i, j) and (a, b) """
     return sqrt((i - a)**2 + (j - b)**2)
 
 
-def make_initial_lattice(n):
-    """ Generates a random initial lattice with occupancy around 50% """
-    lattice = zeros((n, n), dtype=int)
-    for i, j in product(range(n), range(n)):
-        lattice[i, j] = 1 if random() > 0.5 else 0
-    return lattice
+def make_initial_lattice(n, stream=None):
+    """ Generates a random (uint8) initial lattice with occupancy around 50%, from the given stream (or a fresh one) """
+    if stream is None:
+        stream = get_stream(draw_seed(), -1)
+    return make_random_lattice(n, stream)
 
 
 def get_forest_cover(rainfall):
@@ -71,51 +186,317 @@ def get_forest_cover(rainfall):
     return slope * rainfall + intercept
 
 
-def simulate(simulation_index):
-    """ Simulates the vegetation automaton """
-    lattice = make_initial_lattice(n)
-    lattice_record = []
+def simulate(parameters, seed=None, update_mode="sequential", show_progress=False, observers=None,
+             checkpoint_path=None, checkpoint_interval=None, checkpoint_time=None):
+    """ Simulates the vegetation automaton, with sequential, synchronous or tiled (parallel sequential) updates
+    The lattice is passed to the observers after every step, and the simulation ends before mc_steps if an observer
+    sets its stop attribute. Without observers, the whole lattice record is returned
+    If an observer has a cluster tracker, it is updated by mc_step on every flip (sequential updates only)
+    With a checkpoint_path, the state is saved every checkpoint_interval steps and/or checkpoint_time seconds,
+    and a simulation whose checkpoint exists resumes from it. The checkpoint is removed when the simulation ends """
+    n = parameters["n"]
+    mc_steps = parameters["mc_steps"]
+    mc_fraction = parameters["mc_fraction"]
+    f_carrying = get_forest_cover(parameters["rainfall"])
+
+    return_record = observers is None
+    if return_record:
+        observers = [SnapshotObserver()]
 
-    for step in range(mc_steps):
-        if simulation_index == num_simulations - 1:
+    # the stencil and normalization depend only on the parameters, the density field is
+    # updated by mc_step whenever a cell flips
+    offsets, weights = make_stencil(parameters["r_influence"], parameters["immediacy"])
+    normalization = make_normalization(n, offsets, weights)
+
+    if update_mode not in ["sequential", "synchronous", "tiled"]:
+        raise ValueError("Invalid update mode")
+    if update_mode == "synchronous":
+        kernel_fft = make_kernel_fft(n, offsets, weights)
+    if update_mode == "tiled":
+        schedule = make_tile_schedule(n, parameters["r_influence"], mc_fraction)
+
+    if checkpoint_path is not None and os.path.exists(checkpoint_path):
+        # the density field is restored rather than recomputed, since its incremental updates
+        # are not bit-identical to a fresh sum
+        lattice, density, first_step, seed = restore_checkpoint(checkpoint_path, parameters, seed, update_mode,
+                                                                observers)
+    else:
+        # unseeded runs draw their seed, so that they are reproducible (and resumable) as well
+        if seed is None:
+            seed = draw_seed()
+        lattice = make_initial_lattice(n, get_stream(seed, -1))
+        density = make_density_field(lattice, offsets, weights) if update_mode != "synchronous" else None
+        first_step = 0
+
+        for observer in observers:
+            if hasattr(observer, "start"):
+                observer.start(lattice)
+
+    trackers = [observer.tracker for observer in observers if hasattr(observer, "tracker")]
+    if len(trackers) > 1:
+        raise ValueError("Only one cluster tracker can be used")
+    if len(trackers) == 1 and update_mode != "sequential":
+        raise ValueError("Cluster tracking requires sequential updates")
+    tracker = trackers[0] if len(trackers) == 1 else None
+
+    # counting and timing only happen with metrics enabled, otherwise mc_step is compiled without counters
+    counters = zeros(4, dtype=int64) if metrics_enabled() else None
+    num_updates = int(mc_fraction * n * n)
+    emit_metrics("simulation_start", parameters=parameters, seed=seed, update_mode=update_mode, first_step=first_step)
+    last_checkpoint_time = perf_counter()
+
+    for step in range(first_step, mc_steps):
+        if show_progress:
             print(f"{round(step * 100 /mc_steps, 2)} %", end="\r")
-        mc_step(lattice)
-        lattice_record.append(copy(lattice))
 
-    return lattice_record
+        # every step draws from its own stream, so that a run resumed from a checkpoint
+        # is identical to an uninterrupted one
+        stream = get_stream(seed, step)
+
+        if counters is not None:
+            counters[:] = 0
+            start_time = perf_counter()
+
+        if update_mode == "sequential":
+            uniforms = stream.random((num_updates, 3))
+            mc_step(lattice, density, normalization, offsets, weights, f_carrying, uniforms, tracker, counters)
+        elif update_mode == "tiled":
+            mc_step_tiled(lattice, density, normalization, offsets, weights, f_carrying, schedule, stream, counters)
+        else:
+            mc_step_synchronous(lattice, kernel_fft, normalization, f_carrying, mc_fraction, stream, counters)
+
+        if counters is None:
+            for observer in observers:
+                observer.observe(step, lattice)
+        else:
+            observe_with_metrics(observers, step, lattice, counters, perf_counter() - start_time, mc_steps)
+
+        if any(getattr(observer, "stop", False) for observer in observers):
+            break
+
+        if checkpoint_path is not None and step + 1 < mc_steps:
+            if (checkpoint_interval is not None and (step + 1) % checkpoint_interval == 0) or \
+                    (checkpoint_time is not None and perf_counter() - last_checkpoint_time >= checkpoint_time):
+                save_checkpoint(checkpoint_path, {"parameters": parameters, "seed": seed, "update_mode": update_mode,
+                                                  "step": step + 1, "lattice": lattice, "density": density,
+                                                  "observers": observers})
+                last_checkpoint_time = perf_counter()
+
+    for observer in observers:
+        observer.finish(lattice)
+    emit_metrics("simulation_finish", mc_steps=mc_steps, num_steps=step + 1)
+
+    if checkpoint_path is not None and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    if return_record:
+        return observers[0].snapshots
+
+
+def restore_checkpoint(checkpoint_path, parameters, seed, update_mode, observers):
+    """ Restores the observers from a checkpoint (in place), returns the lattice, density field, next step and seed
+    Without a seed, the (drawn) seed of the checkpoint is used """
+    checkpoint = load_checkpoint(checkpoint_path)
+    if seed is None:
+        seed = checkpoint["seed"]
+    if (checkpoint["parameters"], checkpoint["seed"], checkpoint["update_mode"]) != (parameters, seed, update_mode):
+        raise ValueError("The checkpoint belongs to a simulation with different parameters, seed or update mode")
+
+    saved_observers = checkpoint["observers"]
+    if [type(observer) for observer in saved_observers] != [type(observer) for observer in observers]:
+        raise ValueError("The observers do not match those of the checkpoint")
+    for observer, saved_observer in zip(observers, saved_observers):
+        observer.__dict__.update(saved_observer.__dict__)
+
+    emit_metrics("resume", path=checkpoint_path, step=checkpoint["step"])
+    return checkpoint["lattice"], checkpoint["density"], checkpoint["step"], seed
+
+
+def observe_with_metrics(observers, step, lattice, counters, step_time, mc_steps):
+    """ Passes the lattice to the observers, timing each, and emits the metrics of the step """
+    observer_times = {}
+    for observer in observers:
+        start_time = perf_counter()
+        observer.observe(step, lattice)
+        observer_times[type(observer).__name__] = perf_counter() - start_time
+
+    growth_proposals, growths, decay_proposals, decays = (int(count) for count in counters)
+    emit_metrics("step", step=step, progress=(step + 1) / mc_steps, step_time=step_time,
+                 observer_time=float(sum(list(observer_times.values()))), observer_times=observer_times,
+                 growth_proposals=growth_proposals, growths=growths,
+                 decay_proposals=decay_proposals, decays=decays,
+                 forest_cover=float(sum(lattice)) / lattice.size)
+
+
+def get_member_seeds(seed, num_simulations):
+    """ Generates statistically independent seeds for every member of an ensemble """
+    seed_sequence = SeedSequence(seed)
+    return [get_child_seed(child) for child in seed_sequence.spawn(num_simulations)], seed_sequence.entropy
+
+
+def simulate_member(parameters, seed, update_mode, num_file, metrics_path=None, checkpoint_interval=None,
+                    checkpoint_time=None, num_samples=None):
+    """ Simulates a single member of an ensemble in a worker process, writing its trajectory while it runs
+    The member is checkpointed next to its trajectory, and resumes from its checkpoint if there is one
+    With num_samples, it stops once it holds that many decorrelated samples after equilibrating
+    Once finished, its statistics (and equilibration time) are stored in the catalog """
+    if metrics_path is not None:
+        enable_metrics(metrics_path, member=num_file)
+
+    forest_cover_observer = ForestCoverObserver()
+    trajectory_observer = TrajectoryObserver(get_simulation_path(num_file), parameters["n"])
+    snapshot_observer = SnapshotObserver(stride=parameters["mc_steps"])
+    equilibration_observer = EquilibrationObserver(num_samples)
+    simulate(parameters, seed, update_mode,
+             observers=[forest_cover_observer, trajectory_observer, snapshot_observer, equilibration_observer],
+             checkpoint_path=get_simulation_path(num_file, "ckpt"), checkpoint_interval=checkpoint_interval,
+             checkpoint_time=checkpoint_time)
+
+    finish_run(num_file, final_forest_cover=float(forest_cover_observer.forest_cover[-1]),
+               **obtain_observables(snapshot_observer.final_lattice), **equilibration_observer.get_statistics())
+    return forest_cover_observer.forest_cover
+
+
+def run_ensemble(parameters, num_simulations, num_workers=None, seed=None, update_mode="sequential",
+                 checkpoint_interval=None, checkpoint_time=None, num_samples=None):
+    """ Simulates an ensemble on all cores, every member is streamed to its own file under automaton_data
+    Members are checkpointed every checkpoint_interval steps and/or checkpoint_time seconds, so that an
+    interrupted ensemble can be continued by resume_ensemble
+    With num_samples, every member stops (before mc_steps) once it equilibrated and holds that many
+    decorrelated samples of the forest cover """
+    member_seeds, entropy = get_member_seeds(seed, num_simulations)
+    print(f"Ensemble seed: {entropy}")
+
+    # the catalog assigns every member its own file number, even with other ensembles running
+    members = [(parameters, member_seed, update_mode, register_run(parameters, member_seed, update_mode))
+               for member_seed in member_seeds]
+    return run_members(members, num_workers, checkpoint_interval, checkpoint_time, num_samples)
+
+
+def resume_ensemble(num_workers=None, checkpoint_interval=None, checkpoint_time=None):
+    """ Continues every simulation under automaton_data that was interrupted after a checkpoint
+    (with the stopping criterion of its checkpoint) """
+    members = []
+    for num_file in sorted(get_checkpoint_numbers()):
+        checkpoint = load_checkpoint(get_simulation_path(num_file, "ckpt"))
+        members.append((checkpoint["parameters"], checkpoint["seed"], checkpoint["update_mode"], num_file))
+
+    print(f"Resuming {len(members)} simulations")
+    return run_members(members, num_workers, checkpoint_interval, checkpoint_time)
+
+
+def run_members(members, num_workers, checkpoint_interval, checkpoint_time, num_samples=None):
+    """ Simulates the given (parameters, seed, update_mode, num_file) members on all cores, returns their forest covers """
+    num_simulations = len(members)
+    forest_cover_records = []
+    num_updates = 0
+
+    start_time = perf_counter()
+    with ProcessPoolExecutor(num_workers) as pool:
+        futures = {pool.submit(simulate_member, *member, get_metrics_path(), checkpoint_interval, checkpoint_time,
+                               num_samples): member[0] for member in members}
+
+        for num_finished, future in enumerate(as_completed(futures), start=1):
+            forest_cover_records.append(future.result())
+
+            # members that stopped early did fewer than mc_steps steps
+            parameters = futures[future]
+            num_updates += len(forest_cover_records[-1]) * int(parameters["mc_fraction"] * parameters["n"] ** 2)
+            throughput = num_updates / (perf_counter() - start_time)
+            print(f"Simulation {num_finished} / {num_simulations} saved ({throughput:.3g} cell updates / second)")
+            emit_metrics("ensemble_progress", num_finished=num_finished, num_simulations=num_simulations,
+                         throughput=throughput)
+
+    elapsed_time = perf_counter() - start_time
+    emit_metrics("ensemble_finish", num_simulations=num_simulations, elapsed_time=elapsed_time)
+    print(f"Ensemble finished in {elapsed_time:.1f} s")
+    print(f"Aggregate throughput: {num_updates / elapsed_time:.3g} cell updates / second")
+    return forest_cover_records
+
+
+def compare_update_modes(parameters, num_samples, seed=None):
+    """ Compares the final forest cover and cluster exponent of the sequential, synchronous and tiled update modes """
+    sample_seeds, _ = get_member_seeds(seed, num_samples)
+
+    for update_mode in ["sequential", "synchronous", "tiled"]:
+        forest_covers = []
+        betas = []
+
+        for sample_seed in sample_seeds:
+            forest_cover_observer = ForestCoverObserver()
+            snapshot_observer = SnapshotObserver(stride=parameters["mc_steps"])
+            simulate(parameters, sample_seed, update_mode, observers=[forest_cover_observer, snapshot_observer])
+            forest_covers.append(forest_cover_observer.forest_cover[-1])
+
+            beta, _, _ = fit_probabilities(get_lattice_probabilities(snapshot_observer.final_lattice))
+            betas.append(beta)
+
+        print(f"{update_mode.capitalize()} updates ({num_samples} samples):")
+        print(f"    Forest cover: {mean(forest_covers)} +/- {std(forest_covers)}")
+        print(f"    Beta: {mean(betas)} +/- {std(betas)}")
+
+
+def plot_forest_cover(forest_cover_records, rainfall):
+    """ Plots the forest cover of every simulation against time, with the carrying capacity """
+    from matplotlib import pyplot as plt
+    f_carrying = get_forest_cover(rainfall)
+
+    for forest_cover in forest_cover_records:
+        time = list(range(len(forest_cover)))
+        plt.title(f"Change of forest cover with time (rainfall = {rainfall} mm/year)")
+        plt.xlabel("Time (years)")
+        plt.ylabel("Forest cover")
+        plt.plot(time, forest_cover)
+        plt.plot(time, [f_carrying] * len(time))
+        plt.legend(["Forest cover", "Carrying capacity"])
+        plt.show()
 
 
 if __name__ == '__main__':
     show_trajectory = False
+    validate_update_modes = False
 
-    # simulation parameters
-    mc_steps = 200
-    mc_fraction = 0.2
+    # "sequential" updates one random cell at a time, "synchronous" updates a random
+    # mc_fraction of cells at once (faster for very large lattices), "tiled" updates one
+    # random cell at a time in each of many tiles in parallel (for a single very large lattice)
+    update_mode = "sequential"
 
-    # constants
-    n = 500
-    rainfall = 500
-    f_carrying = get_forest_cover(rainfall)
-    r_influence = 6
-    immediacy = 24
+    parameters = default_parameters.copy()
 
     num_simulations = 10
 
-    print("Compiling functions (will take a few seconds ...)")
-    with ThreadPoolExecutor(7) as pool:
-        lattice_records = pool.map(simulate, range(num_simulations))
-
-    for lattice_record in lattice_records:
-        save_automaton_data(lattice_record)
-
-        if show_trajectory:
-            time = list(range(mc_steps))
-            forest_cover = [sum(lattice) / (n * n) for lattice in lattice_record]
-            plt.title(f"Change of forest cover with time (rainfall = {rainfall} mm/year)")
-            plt.xlabel("Time (years)")
-            plt.ylabel("Forest cover")
-            plt.plot(time, forest_cover)
-            plt.plot(time, [f_carrying] * len(time))
-            plt.legend(["Forest cover", "Carrying capacity"])
-            plt.show()
-        
\ No newline at end of file
+    # None uses all cores, seed = None draws a fresh ensemble seed (printed for reproduction)
+    num_workers = None
+    seed = None
+
+    # set to a file name (e.g. "metrics.jsonl") to stream step timings, acceptance counts, I/O and
+    # progress of every worker as JSON lines, summarized by metrics.py
+    metrics_file_name = None
+
+    # checkpoints of every member are saved every checkpoint_interval steps and/or checkpoint_time
+    # seconds (None disables either), resume continues the members interrupted after a checkpoint
+    checkpoint_interval = None
+    checkpoint_time = 600
+    resume = False
+
+    # with num_samples, members stop as soon as they hold that many decorrelated samples after equilibrating
+    # (mc_steps is then only an upper limit), None always runs mc_steps. The equilibration time of every
+    # member is recorded in the catalog either way
+    num_samples = None
+
+    if metrics_file_name is not None:
+        enable_metrics(os.path.join(os.path.dirname(__file__), metrics_file_name))
+
+    print("Loading compiled functions (they are only compiled on the first run, which takes a few seconds ...)")
+    if validate_update_modes:
+        compare_update_modes(parameters, num_simulations, seed)
+        exit()
+
+    if resume:
+        forest_cover_records = resume_ensemble(num_workers, checkpoint_interval, checkpoint_time)
+    else:
+        forest_cover_records = run_ensemble(parameters, num_simulations, num_workers, seed, update_mode,
+                                            checkpoint_interval, checkpoint_time, num_samples)
+
+    if show_trajectory:
+        plot_forest_cover(forest_cover_records, parameters["rainfall"])
@@ -0,0 +1,154 @@
+# Benchmarks the hot paths of the simulation and the analysis, across lattice sizes and radii of influence
+# The first call of every compiled function is timed separately, so that the numba compile time does not
+# pollute the steady-state times. Results are written to benchmark_data/latest.json and compared against
+# benchmark_data/baseline.json, flagging every benchmark that became slower than the threshold allows
+
+from json import dump, load
+from numpy import median
+from numpy.random import default_rng, random
+from time import perf_counter
+import os
+import sys
+
+from automaton import get_density, get_forest_cover, make_initial_lattice, make_tile_schedule, mc_step, mc_step_tiled
+from cluster import cluster_lattice
+from cluster_statistics import measure_lattices
+from density import make_density_field, make_normalization, make_stencil
+from linear_regression import perform_linear_regression
+from power_law import get_cluster_probabilities
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "ising"))
+from ising import calc_energy
+
+
+def get_benchmark_path(file_name):
+    """ Returns a path inside the benchmark_data folder """
+    current_path = os.path.dirname(__file__)
+    return os.path.join(current_path, "benchmark_data", file_name)
+
+
+def time_function(function, repeats):
+    """ Returns the time of the first call and the median time of the following calls """
+    start_time = perf_counter()
+    function()
+    first_time = perf_counter() - start_time
+
+    times = []
+    for _ in range(repeats):
+        start_time = perf_counter()
+        function()
+        times.append(perf_counter() - start_time)
+    return first_time, float(median(times))
+
+
+def make_automaton_state(n, r_influence):
+    """ Returns a random lattice with its stencil, normalization and density field """
+    lattice = make_initial_lattice(n)
+    offsets, weights = make_stencil(r_influence, 24)
+    normalization = make_normalization(n, offsets, weights)
+    density = make_density_field(lattice, offsets, weights)
+    return lattice, density, normalization, offsets, weights
+
+
+def get_benchmarks(sizes, radii):
+    """ Generates (name, parameters, function) for every benchmark, preparing the inputs only when needed """
+    for n in sizes:
+        for r_influence in radii:
+            lattice, density, normalization, offsets, weights = make_automaton_state(n, r_influence)
+            f_carrying = get_forest_cover(500)
+            uniforms = random((int(0.2 * n * n), 3))
+            yield ("mc_step", {"n": n, "r_influence": r_influence},
+                   lambda: mc_step(lattice, density, normalization, offsets, weights, f_carrying, uniforms))
+
+            schedule = make_tile_schedule(n, r_influence, 0.2)
+            yield ("mc_step_tiled", {"n": n, "r_influence": r_influence},
+                   lambda: mc_step_tiled(lattice, density, normalization, offsets, weights, f_carrying, schedule,
+                                         default_rng()))
+
+            cells = (random((1000, 2)) * n).astype(int)
+            yield ("get_density (1000 cells)", {"n": n, "r_influence": r_influence},
+                   lambda: [get_density(lattice, i, j, r_influence, 24) for i, j in cells])
+
+        lattice = make_initial_lattice(n)
+        cluster_sizes = cluster_lattice(lattice, trim=True)
+        yield "cluster_lattice", {"n": n}, lambda: cluster_lattice(lattice, trim=True)
+        yield "measure_lattices", {"n": n}, lambda: measure_lattices(lattice)
+        yield "get_probabilities", {"n": n}, lambda: get_cluster_probabilities(cluster_sizes)
+
+        x = random(n * n)
+        y = 2 * x + random(n * n)
+        yield "perform_linear_regression", {"n": n}, lambda: perform_linear_regression(x, y)
+
+        spins = 2.0 * (random((n, n)) > 0.5) - 1
+        yield "calc_energy", {"n": n}, lambda: calc_energy(spins)
+
+
+def run_benchmarks(sizes, radii, repeats):
+    """ Runs every benchmark, returns a list of results """
+    results = []
+    compiled = set()
+
+    for name, parameters, function in get_benchmarks(sizes, radii):
+        first_time, steady_time = time_function(function, repeats)
+
+        # only the first call of a function (with the first parameters) includes compilation
+        compile_time = max(first_time - steady_time, 0) if name not in compiled else 0.0
+        compiled.add(name)
+
+        results.append({"name": name, "parameters": parameters, "time": steady_time, "compile_time": compile_time})
+        print(f"{name} {parameters}: {steady_time * 1000:.3f} ms (compile {compile_time:.2f} s)")
+    return results
+
+
+def get_benchmark_key(result):
+    return result["name"] + " " + " ".join(f"{name}={value}" for name, value in sorted(result["parameters"].items()))
+
+
+def compare_with_baseline(results, baseline, threshold):
+    """ Prints the change of every benchmark w.r.t. the baseline, returns the keys of the regressions """
+    baseline_times = {get_benchmark_key(result): result["time"] for result in baseline}
+    regressions = []
+
+    for result in results:
+        key = get_benchmark_key(result)
+        if key not in baseline_times:
+            continue
+
+        ratio = result["time"] / baseline_times[key]
+        flag = ""
+        if ratio > 1 + threshold:
+            regressions.append(key)
+            flag = "  <-- REGRESSION"
+        print(f"{key}: {ratio:.2f}x baseline{flag}")
+    return regressions
+
+
+if __name__ == '__main__':
+    sizes = [100, 250, 500, 1000, 2000]
+    radii = [2, 6, 10]
+    repeats = 5
+
+    # fractional slowdown beyond which a benchmark is flagged
+    regression_threshold = 0.2
+
+    # set to True to store this run as the baseline for later comparisons
+    save_as_baseline = False
+
+    print("Compiling functions (the compile time of each is reported separately) ...")
+    results = run_benchmarks(sizes, radii, repeats)
+
+    os.makedirs(get_benchmark_path(""), exist_ok=True)
+    with open(get_benchmark_path("latest.json"), "w") as file:
+        dump(results, file, indent=4)
+
+    if save_as_baseline:
+        with open(get_benchmark_path("baseline.json"), "w") as file:
+            dump(results, file, indent=4)
+    elif os.path.exists(get_benchmark_path("baseline.json")):
+        with open(get_benchmark_path("baseline.json")) as file:
+            baseline = load(file)
+
+        regressions = compare_with_baseline(results, baseline, regression_threshold)
+        print(f"{len(regressions)} regressions beyond {regression_threshold * 100:.0f}%")
+        if len(regressions) > 0:
+            sys.exit(1)
@@ -0,0 +1,198 @@
+# Single command-line entry point for the simulation and analysis scripts, e.g.
+#     python cli.py simulate --rainfall 600 --num-simulations 10 --plot
+#     python cli.py analyze --rainfall 600
+#     python cli.py play 3 --export simulation.mp4
+# Every subcommand imports only the modules it needs, when it runs, and plotting libraries only when a plot is
+# requested. The numba kernels are cached on disk (__pycache__) the first time they are compiled, so later
+# launches load them instead of compiling them again. numba does not track which cached kernels call which,
+# so after editing a kernel that other kernels call, delete the __pycache__ folders to recompile its callers
+
+from argparse import ArgumentParser
+import os
+import sys
+
+
+def number(text):
+    """ Parses an int if possible (as in default_parameters), and a float otherwise """
+    value = float(text)
+    return int(value) if value.is_integer() else value
+
+
+# parameters that select runs from the catalog, and that override default_parameters for new simulations
+parameter_types = {"n": int, "mc_steps": int, "mc_fraction": float, "rainfall": number, "r_influence": int,
+                   "immediacy": number}
+
+
+def add_parameter_arguments(parser):
+    for name, parameter_type in parameter_types.items():
+        parser.add_argument("--" + name.replace("_", "-"), type=parameter_type, dest=name)
+
+
+def get_parameters(arguments):
+    """ Returns the parameters given on the command line """
+    return {name: getattr(arguments, name) for name in parameter_types if getattr(arguments, name) is not None}
+
+
+def find_selected_runs(arguments):
+    from data_manager import find_runs
+    simulation_indices = find_runs(update_mode=arguments.update_mode, **get_parameters(arguments))
+    print(f"{len(simulation_indices)} simulations selected")
+    return simulation_indices
+
+
+def simulate_command(arguments):
+    from automaton import compare_update_modes, default_parameters, plot_forest_cover, resume_ensemble, run_ensemble
+    from metrics import enable_metrics
+
+    parameters = default_parameters.copy()
+    parameters.update(get_parameters(arguments))
+    if arguments.metrics is not None:
+        enable_metrics(arguments.metrics)
+
+    if arguments.compare_update_modes:
+        compare_update_modes(parameters, arguments.num_simulations, arguments.seed)
+        return
+
+    if arguments.resume:
+        forest_cover_records = resume_ensemble(arguments.workers, arguments.checkpoint_interval,
+                                               arguments.checkpoint_time)
+    else:
+        forest_cover_records = run_ensemble(parameters, arguments.num_simulations, arguments.workers, arguments.seed,
+                                            arguments.update_mode, arguments.checkpoint_interval,
+                                            arguments.checkpoint_time, arguments.num_samples)
+    if arguments.plot:
+        plot_forest_cover(forest_cover_records, parameters["rainfall"])
+
+
+def analyze_command(arguments):
+    from power_law import analyse_ensemble
+    analyse_ensemble(find_selected_runs(arguments), arguments.plot)
+
+
+def timeseries_command(arguments):
+    from time_series_analysis import analyse_time_series, plot_time_series, save_time_series
+
+    simulation_indices = find_selected_runs(arguments)
+    time_indices = list(range(*arguments.times))
+    print(f"Processing {len(simulation_indices)} simulations at {len(time_indices)} time steps ...")
+    results = analyse_time_series(simulation_indices, time_indices, arguments.workers)
+
+    save_time_series(results, arguments.output)
+    if arguments.plot:
+        plot_time_series(results)
+
+
+def correlation_command(arguments):
+    from spatial_correlation import analyse_spatial_correlations, plot_spatial_correlations, save_spatial_correlations
+
+    simulation_indices = find_selected_runs(arguments)
+    time_indices = list(range(*arguments.times))
+    print(f"Processing {len(simulation_indices)} simulations at {len(time_indices)} time steps ...")
+    results = analyse_spatial_correlations(simulation_indices, time_indices, arguments.workers, arguments.max_distance,
+                                           int(arguments.max_memory * 2 ** 20))
+
+    save_spatial_correlations(results, arguments.output)
+    if arguments.plot:
+        plot_spatial_correlations(results)
+
+
+def stats_command(arguments):
+    from cluster_statistics import print_ensemble_statistics
+    print_ensemble_statistics(find_selected_runs(arguments))
+
+
+def play_command(arguments):
+    from show_simulation import FrameStream, Player, export_video
+
+    frames = FrameStream(arguments.simulation_index, arguments.max_resolution)
+    if arguments.export is None:
+        from matplotlib import pyplot as plt
+        player = Player(frames, arguments.interval, arguments.stride, arguments.start)
+        plt.show()
+    else:
+        export_video(frames, arguments.export, arguments.fps, arguments.stride, arguments.start)
+    frames.close()
+
+
+def ising_command(arguments):
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "ising"))
+    from ising import animate_spins, run_ising
+
+    spins_record = run_ising(arguments.n, arguments.J, arguments.temperature, arguments.mc_steps,
+                             arguments.algorithm, arguments.seed)
+    if arguments.animate:
+        animate_spins(spins_record)
+
+
+# files the results of the analyses over time are written to (inside src) by default
+results_names = {"timeseries": "time_series_results", "correlation": "spatial_correlation_results"}
+
+
+def make_parser():
+    parser = ArgumentParser(description="Simulation and analysis of the vegetation automaton")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    simulate = subparsers.add_parser("simulate", help="simulate an ensemble into automaton_data")
+    add_parameter_arguments(simulate)
+    simulate.add_argument("--num-simulations", type=int, default=10)
+    simulate.add_argument("--workers", type=int, help="number of processes (default: one per core)")
+    simulate.add_argument("--seed", type=int, help="ensemble seed (default: drawn and printed)")
+    simulate.add_argument("--update-mode", choices=["sequential", "synchronous", "tiled"], default="sequential")
+    simulate.add_argument("--num-samples", type=int,
+                          help="stop every member after this many decorrelated samples in equilibrium")
+    simulate.add_argument("--checkpoint-interval", type=int, help="checkpoint every this many steps")
+    simulate.add_argument("--checkpoint-time", type=float, default=600, help="checkpoint every this many seconds")
+    simulate.add_argument("--resume", action="store_true", help="continue the interrupted simulations instead")
+    simulate.add_argument("--metrics", help="append the metrics of the run to this JSON lines file")
+    simulate.add_argument("--compare-update-modes", action="store_true",
+                          help="compare the update modes on num-simulations samples, without saving them")
+    simulate.add_argument("--plot", action="store_true", help="plot the forest cover of every simulation")
+    simulate.set_defaults(function=simulate_command)
+
+    for name, function, help_text in [("analyze", analyze_command, "fit the power law of the pooled final clusters"),
+                                      ("timeseries", timeseries_command, "fit the power law at many time steps"),
+                                      ("correlation", correlation_command,
+                                       "two-point correlation, structure factor and correlation length with time"),
+                                      ("stats", stats_command, "average cluster statistics of the final lattices")]:
+        subparser = subparsers.add_parser(name, help=help_text,
+                                          description=help_text + ", of the catalog runs with the given parameters")
+        add_parameter_arguments(subparser)
+        subparser.add_argument("--update-mode", choices=["sequential", "synchronous", "tiled"])
+        subparser.set_defaults(function=function)
+
+        if name != "stats":
+            subparser.add_argument("--plot", action="store_true")
+        if name in ["timeseries", "correlation"]:
+            subparser.add_argument("--times", type=int, nargs=3, default=[0, 200, 10], metavar=("START", "STOP", "STEP"))
+            subparser.add_argument("--workers", type=int, help="number of processes (default: one per core)")
+            subparser.add_argument("--output", default=os.path.join(os.path.dirname(__file__), f"{results_names[name]}.json"))
+        if name == "correlation":
+            subparser.add_argument("--max-distance", type=int, help="largest distance of C(r) (default: n / 2)")
+            subparser.add_argument("--max-memory", type=float, default=256, help="MiB for the FFTs of every process")
+
+    play = subparsers.add_parser("play", help="play a simulation, or export it to a video")
+    play.add_argument("simulation_index", type=int)
+    play.add_argument("--max-resolution", type=int, default=512)
+    play.add_argument("--stride", type=int, default=1)
+    play.add_argument("--start", type=int, default=0)
+    play.add_argument("--interval", type=int, default=100, help="milliseconds per frame")
+    play.add_argument("--export", help="video file to write instead of playing (e.g. simulation.mp4 or .gif)")
+    play.add_argument("--fps", type=int, default=10)
+    play.set_defaults(function=play_command)
+
+    ising = subparsers.add_parser("ising", help="simulate the Ising model")
+    ising.add_argument("--n", type=int, default=100)
+    ising.add_argument("--J", type=float, default=1)
+    ising.add_argument("--temperature", type=float, default=1)
+    ising.add_argument("--mc-steps", type=int, default=100000)
+    ising.add_argument("--algorithm", choices=["metropolis", "checkerboard", "wolff", "swendsen_wang"],
+                       default="metropolis")
+    ising.add_argument("--seed", type=int)
+    ising.add_argument("--animate", action="store_true")
+    ising.set_defaults(function=ising_command)
+    return parser
+
+
+if __name__ == '__main__':
+    arguments = make_parser().parse_args()
+    arguments.function(arguments)
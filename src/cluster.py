@@ -1,43 +1,345 @@
-from numpy import zeros
+# Compiled cluster labeling (Hoshen-Kopelman with union-find) of the vegetation lattice
+# Supports von Neumann (4) or Moore (8) connectivity and open or periodic boundaries
 
-def cluster_lattice(lattice, trim=False):
-    """ Calculates number of clusters of each size, in the given lattce """
+from numba import njit, prange, set_num_threads
+from math import log, nan, sqrt
+from numpy import empty, float64, int32, int64, sort, zeros
+
+
+@njit(nogil=True, cache=True)
+def find(parent, x):
+    """ Returns the root label of x, halving the path on the way """
+    while parent[x] != x:
+        parent[x] = parent[parent[x]]
+        x = parent[x]
+    return x
+
+
+@njit(nogil=True, cache=True)
+def union(parent, x, y):
+    """ Merges the clusters of labels x and y, the smaller root label becomes the root of both """
+    x = find(parent, x)
+    y = find(parent, y)
+    if x < y:
+        parent[y] = x
+        return x
+    parent[x] = y
+    return y
+
+
+@njit(nogil=True, cache=True)
+def link(lattice, labels, parent, i, j, a, b):
+    """ Merges the clusters of cells (i, j) and (a, b) if both are occupied """
+    if lattice[i, j] != 0 and lattice[a, b] != 0:
+        union(parent, labels[i, j], labels[a, b])
+
+
+@njit(nogil=True, cache=True)
+def label_clusters(lattice, labels, moore, periodic):
+    """ Labels the clusters of occupied cells with 1, 2, ... (0 for empty cells), returns the number of clusters """
     n = len(lattice)
-    cluster_sizes = zeros((n * n + 1), dtype=(int))
-    visited = zeros((n, n), dtype=(int, int))
+    parent = empty(n * n + 1, dtype=int64)
+    next_label = 1
 
+    # single raster scan, merging with the already visited neighbours
     for i in range(n):
         for j in range(n):
-            if not visited[i][j]:
-                visited[i][j] = 1
+            labels[i, j] = 0
+            if lattice[i, j] == 0:
+                continue
 
-                if lattice[i][j] == 0:
-                    cluster_sizes[0] += 1
+            label = 0
+            for a, b in ((i - 1, j), (i, j - 1), (i - 1, j - 1), (i - 1, j + 1)):
+                if not moore and a != i and b != j:
                     continue
+                if 0 <= a < n and 0 <= b < n and lattice[a, b] != 0:
+                    if label == 0:
+                        label = find(parent, labels[a, b])
+                    else:
+                        label = union(parent, label, labels[a, b])
 
-                current_cluster_size = 1
-                stack = [(i, j)]
+            if label == 0:
+                label = next_label
+                parent[label] = label
+                next_label += 1
+            labels[i, j] = label
 
-                while len(stack) > 0:
-                    i, j = stack.pop()
-                    von_neumann_neighbours = [(i - 1, j), (i + 1, j),
-                                              (i, j - 1), (i, j + 1)]
+    if periodic:
+        for k in range(n):
+            link(lattice, labels, parent, 0, k, n - 1, k)
+            link(lattice, labels, parent, k, 0, k, n - 1)
+            if moore:
+                link(lattice, labels, parent, 0, k, n - 1, (k - 1) % n)
+                link(lattice, labels, parent, 0, k, n - 1, (k + 1) % n)
+                link(lattice, labels, parent, k, 0, (k - 1) % n, n - 1)
+                link(lattice, labels, parent, k, 0, (k + 1) % n, n - 1)
 
-                    for i, j in von_neumann_neighbours:
-                        if 0 <= i < n and 0 <= j < n:
-                            if lattice[i][j] == 1 and not visited[i][j]:
-                                visited[i][j] = True
-                                stack.append((i, j))
-                                current_cluster_size += 1
-                cluster_sizes[current_cluster_size] += 1
+    # roots always have the smallest label of their cluster, so they are numbered first
+    compact_labels = zeros(next_label, dtype=int64)
+    num_clusters = 0
+    for label in range(1, next_label):
+        root = find(parent, label)
+        if root == label:
+            num_clusters += 1
+            compact_labels[label] = num_clusters
+        else:
+            compact_labels[label] = compact_labels[root]
 
-    if trim:
-        max_cluster_size = -1
-        for i in range(n * n, 0, -1):
-            if cluster_sizes[i] > 0:
-                max_cluster_size = i
-                break
+    for i in range(n):
+        for j in range(n):
+            labels[i, j] = compact_labels[labels[i, j]]
+    return num_clusters
+
+
+@njit(nogil=True, cache=True)
+def label_bonds(right_bonds, down_bonds, labels):
+    """ Labels the clusters of cells joined by active bonds with 1, 2, ... (every cell belongs to a cluster)
+    right_bonds[i, j] joins (i, j) with (i, j + 1), down_bonds[i, j] joins (i, j) with (i + 1, j)
+    Returns the number of clusters """
+    n = len(labels)
+    parent = empty(n * n + 1, dtype=int64)
+    for label in range(n * n + 1):
+        parent[label] = label
+
+    for i in range(n):
+        for j in range(n):
+            if j < n - 1 and right_bonds[i, j]:
+                union(parent, i * n + j + 1, i * n + j + 2)
+            if i < n - 1 and down_bonds[i, j]:
+                union(parent, i * n + j + 1, (i + 1) * n + j + 1)
 
-        return cluster_sizes[:max_cluster_size + 1]
+    compact_labels = zeros(n * n + 1, dtype=int64)
+    num_clusters = 0
+    for i in range(n):
+        for j in range(n):
+            root = find(parent, i * n + j + 1)
+            if compact_labels[root] == 0:
+                num_clusters += 1
+                compact_labels[root] = num_clusters
+            labels[i, j] = compact_labels[root]
+    return num_clusters
+
+
+@njit(nogil=True, cache=True)
+def count_cluster_sizes(labels, num_clusters):
+    """ Returns the size of every cluster, the 0th element being the number of empty cells """
+    label_sizes = zeros(num_clusters + 1, dtype=int64)
+    for label in labels.ravel():
+        label_sizes[label] += 1
+    return label_sizes
+
+
+@njit(nogil=True, cache=True)
+def fill_histogram(cluster_sizes, label_sizes):
+    """ Fills cluster_sizes with the number of clusters of each size (and the number of empty cells at 0) """
+    cluster_sizes[:] = 0
+    if len(cluster_sizes) == 0:
+        return
+    cluster_sizes[0] = label_sizes[0]
+    for size in label_sizes[1:]:
+        cluster_sizes[size] += 1
+
+
+def limit_worker_threads():
+    """ Initializer of pool workers that each process whole simulations: the pool already uses every core, so the
+    parallel kernels run on a single thread inside them """
+    set_num_threads(1)
+
+
+def check_connectivity(connectivity):
+    if connectivity not in (4, 8):
+        raise ValueError("Connectivity must be 4 (von Neumann) or 8 (Moore)")
+    return connectivity == 8
+
+
+def cluster_lattice(lattice, trim=False, connectivity=4, periodic=False, return_labels=False):
+    """ Calculates number of clusters of each size, in the given lattce """
+    moore = check_connectivity(connectivity)
+    n = len(lattice)
+    labels = empty((n, n), dtype=int32)
+    num_clusters = label_clusters(lattice, labels, moore, periodic)
+    label_sizes = count_cluster_sizes(labels, num_clusters)
+
+    if trim:
+        max_cluster_size = label_sizes[1:].max() if num_clusters > 0 else -1
+        cluster_sizes = empty(max_cluster_size + 1, dtype=int64)
     else:
-        return cluster_sizes
\ No newline at end of file
+        cluster_sizes = empty(n * n + 1, dtype=int64)
+    fill_histogram(cluster_sizes, label_sizes)
+
+    if return_labels:
+        return cluster_sizes, labels
+    return cluster_sizes
+
+
+@njit(parallel=True, cache=True)
+def label_stack(stack, labels, moore, periodic):
+    """ Labels every frame of a (T, n, n) stack in parallel, returns the number of clusters and largest cluster of each """
+    num_frames = len(stack)
+    num_clusters = zeros(num_frames, dtype=int64)
+    max_cluster_sizes = zeros(num_frames, dtype=int64)
+
+    for t in prange(num_frames):
+        num_clusters[t] = label_clusters(stack[t], labels[t], moore, periodic)
+        if num_clusters[t] > 0:
+            max_cluster_sizes[t] = count_cluster_sizes(labels[t], num_clusters[t])[1:].max()
+    return num_clusters, max_cluster_sizes
+
+
+@njit(parallel=True, cache=True)
+def fill_histogram_stack(cluster_sizes, labels, num_clusters):
+    for t in prange(len(labels)):
+        fill_histogram(cluster_sizes[t], count_cluster_sizes(labels[t], num_clusters[t]))
+
+
+def cluster_lattice_stack(stack, trim=False, connectivity=4, periodic=False, return_labels=False):
+    """ Calculates the cluster size histograms of every frame of a (T, n, n) stack in parallel
+    With trim, all histograms are trimmed to the largest cluster found in the stack """
+    moore = check_connectivity(connectivity)
+    num_frames, n = len(stack), len(stack[0])
+    labels = empty((num_frames, n, n), dtype=int32)
+    num_clusters, max_cluster_sizes = label_stack(stack, labels, moore, periodic)
+
+    length = max_cluster_sizes.max() + 1 if trim else n * n + 1
+    cluster_sizes = empty((num_frames, length), dtype=int64)
+    fill_histogram_stack(cluster_sizes, labels, num_clusters)
+
+    if return_labels:
+        return cluster_sizes, labels
+    return cluster_sizes
+
+
+@njit(nogil=True, cache=True)
+def compress_histogram(label_sizes, sizes, counts):
+    """ Fills sizes and counts with the number of empty cells (at size 0) and the number of clusters of every distinct
+    size, in increasing order, from the cluster sizes per label. Returns the number of entries filled
+    A lattice of n^2 cells has fewer than sqrt(2) n distinct cluster sizes, so n * 3 // 2 + 2 entries always suffice """
+    sizes[0] = 0
+    counts[0] = label_sizes[0]
+    num_sizes = 1
+    for size in sort(label_sizes[1:]):
+        if size == sizes[num_sizes - 1]:
+            counts[num_sizes - 1] += 1
+        else:
+            sizes[num_sizes] = size
+            counts[num_sizes] = 1
+            num_sizes += 1
+    return num_sizes
+
+
+# columns of the rows filled by measure_clusters
+cluster_measures = ("num_clusters", "average_cluster_size", "sd", "largest_cluster", "spanning", "average_perimeter",
+                    "average_gyration_radius", "largest_gyration_radius", "fractal_dimension")
+
+
+@njit(nogil=True, cache=True)
+def measure_clusters(lattice, labels, moore, min_area, measures, sizes, counts):
+    """ Labels the clusters of a lattice (open boundaries), fills measures with the columns of cluster_measures and
+    sizes and counts with its cluster size histogram (see compress_histogram), returns the number of entries of these
+    The area, perimeter (edges to empty cells or the boundary) and gyration radius of every cluster are gathered in a
+    single pass over the labels. A cluster spans the lattice if it touches opposite edges, and the fractal dimension
+    D is fitted to the area-perimeter scaling P ~ A^(D / 2) of the clusters of at least min_area cells """
+    n = len(lattice)
+    num_clusters = label_clusters(lattice, labels, moore, False)
+
+    areas = zeros(num_clusters + 1, dtype=int64)
+    perimeters = zeros(num_clusters + 1, dtype=int64)
+    sums = zeros((num_clusters + 1, 3), dtype=float64)
+    edges = zeros((num_clusters + 1, 4), dtype=int64)
+
+    for i in range(n):
+        for j in range(n):
+            label = labels[i, j]
+            areas[label] += 1
+            if label == 0:
+                continue
+            sums[label, 0] += i
+            sums[label, 1] += j
+            sums[label, 2] += i * i + j * j
+
+            for a, b in ((i - 1, j), (i + 1, j), (i, j - 1), (i, j + 1)):
+                if not (0 <= a < n and 0 <= b < n) or lattice[a, b] == 0:
+                    perimeters[label] += 1
+            if i == 0:
+                edges[label, 0] = 1
+            if i == n - 1:
+                edges[label, 1] = 1
+            if j == 0:
+                edges[label, 2] = 1
+            if j == n - 1:
+                edges[label, 3] = 1
+
+    num_sizes = compress_histogram(areas, sizes, counts)
+    measures[:] = 0
+    measures[0] = num_clusters
+    measures[6:] = nan
+    if num_clusters == 0:
+        return num_sizes
+
+    area_sum, area_squares, perimeter_sum, gyration_sum = 0.0, 0.0, 0.0, 0.0
+    largest = 1
+    spanning = False
+    fit_count, fit_x, fit_y, fit_xx, fit_xy = 0, 0.0, 0.0, 0.0, 0.0
+
+    for label in range(1, num_clusters + 1):
+        area = areas[label]
+        area_sum += area
+        area_squares += area * area
+        perimeter_sum += perimeters[label]
+        if area > areas[largest]:
+            largest = label
+        if (edges[label, 0] and edges[label, 1]) or (edges[label, 2] and edges[label, 3]):
+            spanning = True
+
+        mean_i, mean_j = sums[label, 0] / area, sums[label, 1] / area
+        gyration_radius = sqrt(max(sums[label, 2] / area - mean_i * mean_i - mean_j * mean_j, 0.0))
+        gyration_sum += gyration_radius
+
+        if area >= min_area:
+            x, y = log(area), log(perimeters[label])
+            fit_count += 1
+            fit_x += x
+            fit_y += y
+            fit_xx += x * x
+            fit_xy += x * y
+
+    average_size = area_sum / num_clusters
+    measures[1] = average_size
+    measures[2] = sqrt(max(area_squares / num_clusters - average_size * average_size, 0.0))
+    measures[3] = areas[largest]
+    measures[4] = spanning
+    measures[5] = perimeter_sum / num_clusters
+    measures[6] = gyration_sum / num_clusters
+
+    mean_i, mean_j = sums[largest, 0] / areas[largest], sums[largest, 1] / areas[largest]
+    measures[7] = sqrt(max(sums[largest, 2] / areas[largest] - mean_i * mean_i - mean_j * mean_j, 0.0))
+
+    denominator = fit_count * fit_xx - fit_x * fit_x
+    if fit_count > 1 and denominator > 0:
+        measures[8] = 2 * (fit_count * fit_xy - fit_x * fit_y) / denominator
+    return num_sizes
+
+
+@njit(parallel=True, cache=True)
+def measure_stack(stack, moore, min_area):
+    """ Measures every frame of a (T, n, n) stack in parallel, returns a (T, len(cluster_measures)) array and the
+    cluster size histograms, trimmed to the largest cluster found in the stack """
+    num_frames, n = len(stack), len(stack[0])
+    measures = empty((num_frames, len(cluster_measures)), dtype=float64)
+    sizes = empty((num_frames, n * 3 // 2 + 2), dtype=int64)
+    counts = empty((num_frames, n * 3 // 2 + 2), dtype=int64)
+    num_sizes = empty(num_frames, dtype=int64)
+
+    for t in prange(num_frames):
+        labels = empty((n, n), dtype=int32)
+        num_sizes[t] = measure_clusters(stack[t], labels, moore, min_area, measures[t], sizes[t], counts[t])
+
+    # the histograms are only allocated once the largest cluster is known
+    length = 1
+    for t in range(num_frames):
+        length = max(length, sizes[t, num_sizes[t] - 1] + 1)
+    cluster_sizes = zeros((num_frames, length), dtype=int64)
+    for t in prange(num_frames):
+        for k in range(num_sizes[t]):
+            cluster_sizes[t, sizes[t, k]] = counts[t, k]
+    return measures, cluster_sizes
@@ -0,0 +1,172 @@
+# Persistent cache of the cluster size histograms of single frames
+# Entries are keyed by (content hash of the simulation file, time step, connectivity), so they are
+# invalidated automatically when a simulation file changes. Recently used histograms are kept in memory,
+# and all of them are stored under cluster_cache, both with a size-bounded least-recently-used eviction
+
+from collections import OrderedDict
+from hashlib import sha1
+from numpy import flatnonzero, load, save
+import os
+
+from cluster import cluster_lattice, cluster_lattice_stack
+from data_manager import count_automaton_frames, get_simulation_path, load_automaton_frame, load_automaton_frames
+
+
+class ClusterCache:
+    """ Memory and disk cache of cluster size histograms (as returned by cluster_lattice with trim) """
+
+    def __init__(self, memory_limit=256 * 2 ** 20, disk_limit=2 * 2 ** 30, cache_path=None):
+        self.memory_limit = memory_limit
+        self.disk_limit = disk_limit
+        self.cache_path = cache_path or os.path.join(os.path.dirname(__file__), "cluster_cache")
+
+        self.memory = OrderedDict()
+        self.memory_size = 0
+        self.file_hashes = {}
+        self.statistics = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def get_file_hash(self, path):
+        """ Returns the content hash of a file, rehashing only when its size or modification time changed """
+        stat = os.stat(path)
+        stat_key = (stat.st_size, stat.st_mtime_ns)
+
+        if path in self.file_hashes:
+            old_stat_key, old_hash = self.file_hashes[path]
+            if old_stat_key == stat_key:
+                return old_hash
+            self.invalidate(old_hash)
+
+        content_hash = sha1()
+        with open(path, "rb") as file:
+            for block in iter(lambda: file.read(2 ** 20), b""):
+                content_hash.update(block)
+
+        self.file_hashes[path] = (stat_key, content_hash.hexdigest())
+        return content_hash.hexdigest()
+
+    def invalidate(self, content_hash):
+        """ Removes all entries of a file that has changed """
+        self.statistics["invalidations"] += 1
+        for key in [key for key in self.memory if key[0] == content_hash]:
+            self.memory_size -= self.memory.pop(key).nbytes
+
+        if os.path.exists(self.cache_path):
+            for file_name in os.listdir(self.cache_path):
+                if file_name.startswith(content_hash):
+                    os.remove(os.path.join(self.cache_path, file_name))
+
+    def get_file_path(self, simulation_index):
+        path = get_simulation_path(simulation_index)
+        if not os.path.exists(path):
+            path = get_simulation_path(simulation_index, "pkl")
+        return path
+
+    def get_file_name(self, key):
+        return os.path.join(self.cache_path, "{}_{}_{}.npy".format(*key))
+
+    def lookup(self, key):
+        """ Returns a cached histogram from memory or disk, None if it is not cached """
+        if key in self.memory:
+            self.statistics["memory_hits"] += 1
+            self.memory.move_to_end(key)
+            return self.memory[key]
+
+        file_name = self.get_file_name(key)
+        if os.path.exists(file_name):
+            self.statistics["disk_hits"] += 1
+            os.utime(file_name)
+            cluster_sizes = load(file_name)
+            self.store_in_memory(key, cluster_sizes)
+            return cluster_sizes
+        return None
+
+    def get_cluster_sizes(self, simulation_index, time_step=-1, connectivity=4):
+        """ Returns the cluster size histogram of a frame of the simulation file with the given number """
+        # negative time steps are resolved, so that both forms share an entry
+        if time_step < 0:
+            time_step += count_automaton_frames(simulation_index)
+
+        key = (self.get_file_hash(self.get_file_path(simulation_index)), time_step, connectivity)
+        cluster_sizes = self.lookup(key)
+        if cluster_sizes is None:
+            self.statistics["misses"] += 1
+            lattice = load_automaton_frame(simulation_index, time_step)
+            cluster_sizes = cluster_lattice(lattice, trim=True, connectivity=connectivity)
+            self.store_on_disk(self.get_file_name(key), cluster_sizes)
+            self.store_in_memory(key, cluster_sizes)
+        return cluster_sizes
+
+    def get_cluster_sizes_batch(self, simulation_index, time_steps, connectivity=4, batch_size=16):
+        """ Returns the cluster size histograms of a simulation at the given (increasing, non-negative) time steps
+        The frames that are not cached are read in a single pass over the file, and labeled batch_size at a time
+        in parallel """
+        content_hash = self.get_file_hash(self.get_file_path(simulation_index))
+        keys = [(content_hash, time_step, connectivity) for time_step in time_steps]
+        cluster_sizes = [self.lookup(key) for key in keys]
+
+        missing = [k for k, histogram in enumerate(cluster_sizes) if histogram is None]
+        self.statistics["misses"] += len(missing)
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start:start + batch_size]
+            frames = load_automaton_frames(simulation_index, [time_steps[k] for k in batch])
+
+            # the histograms of a batch are padded to its largest cluster, and trimmed to their own here
+            # (as by cluster_lattice with trim)
+            for k, histogram in zip(batch, cluster_lattice_stack(frames, connectivity=connectivity, trim=True)):
+                sizes = flatnonzero(histogram[1:])
+                cluster_sizes[k] = histogram[:sizes[-1] + 2 if len(sizes) > 0 else 0].copy()
+                self.store_on_disk(self.get_file_name(keys[k]), cluster_sizes[k], evict=False)
+                self.store_in_memory(keys[k], cluster_sizes[k])
+
+        if len(missing) > 0:
+            self.evict_from_disk()
+        return cluster_sizes
+
+    def store_in_memory(self, key, cluster_sizes):
+        self.memory[key] = cluster_sizes
+        self.memory_size += cluster_sizes.nbytes
+
+        while self.memory_size > self.memory_limit and len(self.memory) > 1:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_size -= evicted.nbytes
+            self.statistics["evictions"] += 1
+
+    def store_on_disk(self, file_name, cluster_sizes, evict=True):
+        os.makedirs(self.cache_path, exist_ok=True)
+        save(file_name + ".tmp.npy", cluster_sizes)
+        os.replace(file_name + ".tmp.npy", file_name)
+        if evict:
+            self.evict_from_disk()
+
+    def evict_from_disk(self):
+        """ Removes the least recently used files (oldest modification time) until the disk limit is met
+        Files may be evicted by other processes at the same time, which are skipped """
+        entries = []
+        for name in os.listdir(self.cache_path):
+            try:
+                if not name.endswith(".tmp.npy"):
+                    path = os.path.join(self.cache_path, name)
+                    entries.append((os.path.getmtime(path), os.path.getsize(path), path))
+            except FileNotFoundError:
+                pass
+        entries.sort()
+        disk_size = sum(size for _, size, _ in entries)
+
+        while disk_size > self.disk_limit and len(entries) > 1:
+            _, size, path = entries.pop(0)
+            disk_size -= size
+            try:
+                os.remove(path)
+                self.statistics["evictions"] += 1
+            except FileNotFoundError:
+                pass
+
+    def print_statistics(self):
+        hits = self.statistics["memory_hits"] + self.statistics["disk_hits"]
+        total = hits + self.statistics["misses"]
+        print(f"Cluster cache: {hits} / {total} hits ({self.statistics['memory_hits']} in memory, "
+              f"{self.statistics['disk_hits']} on disk), {self.statistics['evictions']} evictions, "
+              f"{self.statistics['invalidations']} invalidations")
+
+
+cluster_cache = ClusterCache()
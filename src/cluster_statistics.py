@@ -1,45 +1,89 @@
-from math import sqrt
-from numpy import mean
-from cluster import cluster_lattice
-from data_manager import load_automaton_data
+from numpy import bool_, concatenate, dtype, empty, float64, int64, nanmean
+from cluster import check_connectivity, cluster_measures, measure_stack
+from data_manager import count_automaton_frames, find_runs, load_automaton_frames
+from power_law import fit_probabilities, get_cluster_probabilities
+
+# fields of the structured arrays returned by measure_lattices, in the order of cluster.cluster_measures
+cluster_statistics_dtype = dtype([
+    ("num_clusters", int64),
+    ("average_cluster_size", float64),
+    ("sd", float64),
+    ("largest_cluster", int64),
+    ("spanning", bool_),
+    ("average_perimeter", float64),
+    ("average_gyration_radius", float64),
+    ("largest_gyration_radius", float64),
+    ("fractal_dimension", float64),
+])
+
+
+def measure_lattices(lattices, connectivity=4, min_area=10, return_cluster_sizes=False):
+    """ Measures the clusters of a lattice, or of every lattice of a (..., n, n) stack (e.g. of ensemble members and
+    time steps) in parallel, with a single labeling of each. Returns a structured array of cluster_statistics_dtype
+    with the leading shape of the stack. The fractal dimension is fitted to the clusters of at least min_area cells
+    With return_cluster_sizes, the cluster size histograms (trimmed to the largest cluster) are returned as well """
+    moore = check_connectivity(connectivity)
+    n = lattices.shape[-1]
+    measures, cluster_sizes = measure_stack(lattices.reshape(-1, n, n), moore, min_area)
+
+    statistics = empty(len(measures), dtype=cluster_statistics_dtype)
+    for column, name in enumerate(cluster_measures):
+        statistics[name] = measures[:, column]
+    statistics = statistics.reshape(lattices.shape[:-2])
+
+    if return_cluster_sizes:
+        return statistics, cluster_sizes.reshape(lattices.shape[:-2] + cluster_sizes.shape[-1:])
+    return statistics
+
+
+def measure_simulation(simulation_index, time_indices, batch_size=16):
+    """ Measures the clusters of a simulation at the given (increasing) time indices, reading the file once
+    and measuring batch_size frames at a time in parallel """
+    batches = []
+    for start in range(0, len(time_indices), batch_size):
+        batches.append(measure_lattices(load_automaton_frames(simulation_index, time_indices[start:start + batch_size])))
+    return concatenate(batches)
 
 
 def obtain_cluster_statistics(lattice):
     """ Given a lattice, calculates it's cluster statistics """
-    cluster_data = cluster_lattice(lattice, True)
-        
-    num_clusters = sum(cluster_data[1:])
-    size = len(lattice)
-    vegetation_area = (size * size) - cluster_data[0]
-    average_cluster_size = vegetation_area / num_clusters
+    statistics = measure_lattices(lattice)
+    return int(statistics["num_clusters"]), float(statistics["average_cluster_size"]), float(statistics["sd"])
 
-    mean_deviation_squared_sum = 0
-    for size, num_clusters_of_size in enumerate(cluster_data[1:]):
-        mean_deviation_squared_sum += num_clusters_of_size * ((size - average_cluster_size)**2)
-    standard_deviation = sqrt(mean_deviation_squared_sum / num_clusters)
 
-    return num_clusters, average_cluster_size, standard_deviation
+def obtain_observables(lattice):
+    """ Returns the cluster statistics and power-law fit of a (final) lattice, as stored for sweeps and runs """
+    statistics, cluster_sizes = measure_lattices(lattice, return_cluster_sizes=True)
+    beta, _, r_squared = fit_probabilities(get_cluster_probabilities(cluster_sizes))
 
+    return {
+        **{name: statistics[name].item() for name in cluster_statistics_dtype.names},
+        "beta": float(beta),
+        "r_squared": float(r_squared),
+    }
 
-if __name__ == '__main__':
-    # simulations that need to be considered
-    simulation_indices = list(range(0, 5))
-
-    num_clusters_list = []
-    average_cluster_size_list = []
-    sd_list = []
 
+def print_ensemble_statistics(simulation_indices):
+    """ Prints the cluster statistics of the final lattices of the given simulations, averaged over them """
+    statistics = []
     for i, simulation_index in enumerate(simulation_indices):
         print(f"Lattice {i + 1} / {len(simulation_indices)} being processed")
-        
-        lattice_records = load_automaton_data(simulation_index)
-        num_clusters, average_cluster_size, sd = obtain_cluster_statistics(lattice_records[-1])
-        cluster_data = cluster_lattice(lattice_records[-1], True)
-
-        num_clusters_list.append(num_clusters)
-        average_cluster_size_list.append(average_cluster_size)
-        sd_list.append(sd)
-
-    print(f"Average number of clusters: {mean(num_clusters_list)}")
-    print(f"Average cluster size: {mean(average_cluster_size_list)}")
-    print(f"Standard deviation of cluster size: {mean(sd_list)}")
\ No newline at end of file
+        final_time_step = count_automaton_frames(simulation_index) - 1
+        statistics.append(measure_simulation(simulation_index, [final_time_step]))
+    statistics = concatenate(statistics)
+
+    print(f"Average number of clusters: {statistics['num_clusters'].mean()}")
+    print(f"Average cluster size: {statistics['average_cluster_size'].mean()}")
+    print(f"Standard deviation of cluster size: {statistics['sd'].mean()}")
+    print(f"Average largest cluster: {statistics['largest_cluster'].mean()}")
+    print(f"Fraction of spanning lattices: {statistics['spanning'].mean()}")
+    print(f"Average cluster perimeter: {statistics['average_perimeter'].mean()}")
+    print(f"Average gyration radius: {nanmean(statistics['average_gyration_radius'])} "
+          f"(largest cluster: {nanmean(statistics['largest_gyration_radius'])})")
+    print(f"Fractal dimension (area-perimeter): {nanmean(statistics['fractal_dimension'])}")
+
+
+if __name__ == '__main__':
+    # simulations that need to be considered, selected from the catalog by their parameters (e.g. {"rainfall": 600})
+    selection = {}
+    print_ensemble_statistics(find_runs(**selection))
@@ -0,0 +1,204 @@
+# Incremental tracking of the clusters (von Neumann connectivity, open boundaries) while the automaton runs
+#
+# The tracker keeps a union-find label for every occupied cell, the size of every cluster and the
+# histogram of cluster sizes (same format as cluster_lattice). Growth merges the neighbouring clusters
+# in O(1). Decay runs one search from every occupied neighbour of the removed cell in lockstep: searches
+# that meet belong to the same piece, and as soon as only one piece is still being explored, the
+# others are complete and are relabeled, while the largest remaining piece keeps the old label.
+# Hence only the smaller fragments of a split cluster are ever visited.
+
+from numba import njit
+from numpy import arange, empty, full, int32, int64, zeros
+
+from cluster import count_cluster_sizes, fill_histogram, find, label_clusters
+
+NEXT_LABEL = 0
+MARK_BASE = 1
+
+
+@njit(nogil=True, cache=True)
+def rebuild_tracker(lattice, tracker):
+    """ Relabels the whole lattice from scratch, which also frees all unused labels """
+    labels, parent, sizes, histogram, marks, queues, state = tracker
+
+    compact_labels = empty(labels.shape, dtype=int32)
+    num_clusters = label_clusters(lattice, compact_labels, False, False)
+    label_sizes = count_cluster_sizes(compact_labels, num_clusters)
+
+    labels[:, :] = compact_labels
+    parent[:num_clusters + 1] = arange(num_clusters + 1)
+    sizes[:num_clusters + 1] = label_sizes
+    fill_histogram(histogram, label_sizes)
+    state[NEXT_LABEL] = num_clusters + 1
+
+
+def make_tracker(lattice):
+    """ Creates the cluster tracker of a lattice """
+    n = len(lattice)
+    capacity = 2 * n * n + 2
+
+    tracker = (zeros((n, n), dtype=int64),         # label of every cell (0 for empty cells)
+               zeros(capacity, dtype=int64),       # union-find parent of every label
+               zeros(capacity, dtype=int64),       # size of every root label
+               zeros(n * n + 1, dtype=int64),      # number of clusters of each size
+               full((n, n), -1, dtype=int64),      # search marks used while removing cells
+               zeros((4, n * n), dtype=int64),     # search queues used while removing cells
+               zeros(2, dtype=int64))              # next free label, current mark base
+    rebuild_tracker(lattice, tracker)
+    return tracker
+
+
+@njit(nogil=True, cache=True)
+def new_label(lattice, tracker, size):
+    """ Returns a fresh root label for a cluster of the given size, or 0 if the labels had to be rebuilt """
+    labels, parent, sizes, histogram, marks, queues, state = tracker
+    if state[NEXT_LABEL] == len(parent):
+        rebuild_tracker(lattice, tracker)
+        return 0
+
+    label = state[NEXT_LABEL]
+    state[NEXT_LABEL] += 1
+    parent[label] = label
+    sizes[label] = size
+    return label
+
+
+@njit(nogil=True, cache=True)
+def add_cell(lattice, tracker, i, j):
+    """ Updates the tracker after the cell (i, j) became occupied """
+    labels, parent, sizes, histogram, marks, queues, state = tracker
+    n = len(lattice)
+    histogram[0] -= 1
+
+    root = 0
+    new_size = 1
+    for a, b in ((i - 1, j), (i + 1, j), (i, j - 1), (i, j + 1)):
+        if 0 <= a < n and 0 <= b < n and lattice[a, b] != 0:
+            neighbour_root = find(parent, labels[a, b])
+            if neighbour_root == root:
+                continue
+
+            histogram[sizes[neighbour_root]] -= 1
+            new_size += sizes[neighbour_root]
+            if root == 0:
+                root = neighbour_root
+            else:
+                parent[neighbour_root] = root
+
+    if root == 0:
+        root = new_label(lattice, tracker, 1)
+        if root == 0:
+            return
+
+    labels[i, j] = root
+    sizes[root] = new_size
+    histogram[new_size] += 1
+
+
+@njit(nogil=True, cache=True)
+def remove_cell(lattice, tracker, i, j):
+    """ Updates the tracker after the cell (i, j) became empty """
+    labels, parent, sizes, histogram, marks, queues, state = tracker
+    n = len(lattice)
+
+    root = find(parent, labels[i, j])
+    old_size = sizes[root]
+    histogram[old_size] -= 1
+    histogram[0] += 1
+    labels[i, j] = 0
+
+    # one search per occupied neighbour, marked with mark_base + search
+    mark_base = state[MARK_BASE]
+    state[MARK_BASE] += 4
+    group = arange(4)
+    head = zeros(4, dtype=int64)
+    tail = zeros(4, dtype=int64)
+
+    num_searches = 0
+    for a, b in ((i - 1, j), (i + 1, j), (i, j - 1), (i, j + 1)):
+        if 0 <= a < n and 0 <= b < n and lattice[a, b] != 0:
+            marks[a, b] = mark_base + num_searches
+            queues[num_searches, 0] = a * n + b
+            tail[num_searches] = 1
+            num_searches += 1
+
+    if num_searches <= 1:
+        sizes[root] = old_size - 1
+        if old_size > 1:
+            histogram[old_size - 1] += 1
+        return
+
+    num_groups = num_searches
+    while True:
+        # a group is still being explored if any of its searches has cells left in its queue
+        num_open_groups = 0
+        for g in range(num_searches):
+            if group[g] == g:
+                for k in range(num_searches):
+                    if group[k] == g and head[k] < tail[k]:
+                        num_open_groups += 1
+                        break
+        if num_groups == 1 or num_open_groups <= 1:
+            break
+
+        for k in range(num_searches):
+            if head[k] == tail[k]:
+                continue
+            cell = queues[k, head[k]]
+            head[k] += 1
+            x, y = cell // n, cell % n
+
+            for a, b in ((x - 1, y), (x + 1, y), (x, y - 1), (x, y + 1)):
+                if 0 <= a < n and 0 <= b < n and lattice[a, b] != 0:
+                    if mark_base <= marks[a, b] < mark_base + 4:
+                        # the searches meet, so their pieces are connected
+                        other = marks[a, b] - mark_base
+                        if group[other] != group[k]:
+                            old_group = group[other]
+                            for m in range(num_searches):
+                                if group[m] == old_group:
+                                    group[m] = group[k]
+                            num_groups -= 1
+                    else:
+                        marks[a, b] = mark_base + k
+                        queues[k, tail[k]] = a * n + b
+                        tail[k] += 1
+
+    if num_groups == 1:
+        sizes[root] = old_size - 1
+        histogram[old_size - 1] += 1
+        return
+
+    # the pieces that were explored completely get new labels, the remaining piece keeps the root label
+    kept_group = -1
+    for g in range(num_searches):
+        if group[g] == g:
+            for k in range(num_searches):
+                if group[k] == g and head[k] < tail[k]:
+                    kept_group = g
+    if kept_group == -1:
+        kept_group = group[0]
+
+    remaining_size = old_size - 1
+    for g in range(num_searches):
+        if group[g] != g or g == kept_group:
+            continue
+
+        piece_size = 0
+        for k in range(num_searches):
+            if group[k] == g:
+                piece_size += tail[k]
+
+        label = new_label(lattice, tracker, piece_size)
+        if label == 0:
+            return
+        for k in range(num_searches):
+            if group[k] == g:
+                for q in range(tail[k]):
+                    labels[queues[k, q] // n, queues[k, q] % n] = label
+
+        histogram[piece_size] += 1
+        remaining_size -= piece_size
+
+    sizes[root] = remaining_size
+    histogram[remaining_size] += 1
@@ -1,45 +1,305 @@
-from numpy import array
+# Storage of the simulations under automaton_data, with a catalog of all runs
+# The catalog is an SQLite database (automaton_data/catalog.db) that assigns run ids atomically, so that
+# concurrent writers never share a simulation file, and records the parameters, seed, status, file and
+# derived statistics of every run, so that analysis scripts can select runs by their parameters
+
+from json import dumps, loads
+from numpy import array, asarray, mean, std
 from pickle import dump, load
+from sqlite3 import Row, connect
+from time import time
 import os
 
+from lattice import as_lattice
+from metrics import timed_metrics
+from trajectory import TrajectoryReader, convert_pickle_file, write_trajectory
+
+
+def get_simulation_path(num_file, extension="traj"):
+    """ Returns the path of the simulation file with the given number under automaton_data """
+    current_path = os.path.dirname(__file__)
+    return os.path.join(current_path, "automaton_data", "simulation_{}.{}".format(num_file, extension))
+
 
-def save_automaton_data(lattice_record):
-    """ Saves the entire simulation data in a pickle file under automaton_data """
+def get_simulation_numbers(extensions=("traj", "pkl")):
+    """ Returns the numbers of all simulation files present in automaton_data """
     current_path = os.path.dirname(__file__)
     files_list = os.listdir(os.path.join(current_path, "automaton_data"))
 
-    num_automaton_simulations = 0
+    simulation_numbers = set()
     for file_name in files_list:
-        if file_name.startswith("simulation_") and file_name.endswith(".pkl"):
-            num_automaton_simulations += 1
+        name, _, extension = file_name.partition(".")
+        if name.startswith("simulation_") and extension in extensions:
+            simulation_numbers.add(int(name[len("simulation_"):]))
+    return simulation_numbers
+
+
+# parameters that are stored in their own (indexed) columns of the catalog, for queries
+CATALOG_PARAMETERS = ["n", "mc_steps", "mc_fraction", "rainfall", "r_influence", "immediacy"]
+
+
+def get_catalog_path():
+    current_path = os.path.dirname(__file__)
+    return os.path.join(current_path, "automaton_data", "catalog.db")
+
+
+def connect_catalog():
+    """ Opens the catalog, creating it on first use, in which case the simulation files already present
+    under automaton_data are registered with their own numbers (and unknown parameters) """
+    connection = connect(get_catalog_path(), timeout=60)
+    connection.row_factory = Row
+
+    if connection.execute("SELECT name FROM sqlite_master WHERE name = 'runs'").fetchone() is not None:
+        return connection
+
+    with connection:
+        # checked again under the write lock, so that concurrent processes create the catalog only once
+        connection.execute("BEGIN IMMEDIATE")
+        exists = connection.execute("SELECT name FROM sqlite_master WHERE name = 'runs'").fetchone() is not None
+        if not exists:
+            parameter_columns = "".join(f"{name} REAL, " for name in CATALOG_PARAMETERS)
+            connection.execute(f"CREATE TABLE runs (id INTEGER PRIMARY KEY AUTOINCREMENT, status TEXT, "
+                               f"{parameter_columns}parameters TEXT, seed TEXT, update_mode TEXT, "
+                               f"file_name TEXT, created REAL, finished REAL, statistics TEXT)")
+            connection.execute("CREATE INDEX runs_parameters ON runs (rainfall, n, r_influence, immediacy)")
+
+            for num_file in sorted(get_simulation_numbers()):
+                extension = "traj" if os.path.exists(get_simulation_path(num_file)) else "pkl"
+                connection.execute("INSERT INTO runs (id, status, file_name, statistics) VALUES (?, ?, ?, ?)",
+                                   (num_file, "finished", os.path.basename(get_simulation_path(num_file, extension)),
+                                    "{}"))
+    return connection
+
+
+def register_run(parameters=None, seed=None, update_mode=None):
+    """ Adds a running simulation to the catalog, and returns its (unique) id, which is also its file number """
+    parameters = parameters or {}
+    connection = connect_catalog()
+    with connection:
+        cursor = connection.execute(
+            f"INSERT INTO runs (status, {', '.join(CATALOG_PARAMETERS)}, parameters, seed, update_mode, created, "
+            f"statistics) VALUES (?, {', '.join('?' * len(CATALOG_PARAMETERS))}, ?, ?, ?, ?, ?)",
+            ("running", *(parameters.get(name) for name in CATALOG_PARAMETERS), dumps(parameters),
+             None if seed is None else str(seed), update_mode, time(), "{}"))
+        run_id = cursor.lastrowid
+        connection.execute("UPDATE runs SET file_name = ? WHERE id = ?",
+                           (os.path.basename(get_simulation_path(run_id)), run_id))
+    connection.close()
+    return run_id
+
+
+def finish_run(run_id, **statistics):
+    """ Marks a run of the catalog as finished, storing its derived statistics """
+    update_run_statistics(run_id, **statistics)
+    connection = connect_catalog()
+    with connection:
+        connection.execute("UPDATE runs SET status = 'finished', finished = ? WHERE id = ?", (time(), run_id))
+    connection.close()
+
+
+def update_run_statistics(run_id, **statistics):
+    """ Adds (or replaces) derived statistics of a run of the catalog """
+    connection = connect_catalog()
+    with connection:
+        row = connection.execute("SELECT statistics FROM runs WHERE id = ?", (run_id,)).fetchone()
+        if row is None:
+            raise ValueError("Invalid run id")
+        connection.execute("UPDATE runs SET statistics = ? WHERE id = ?",
+                           (dumps({**loads(row["statistics"]), **statistics}), run_id))
+    connection.close()
+
+
+def get_run(run_id):
+    """ Returns the catalog entry of a run as a dictionary, with its parameters and statistics decoded """
+    connection = connect_catalog()
+    row = connection.execute("SELECT * FROM runs WHERE id = ?", (run_id,)).fetchone()
+    connection.close()
+    if row is None:
+        raise ValueError("Invalid run id")
+
+    run = dict(row)
+    run["parameters"] = loads(run["parameters"]) if run["parameters"] is not None else None
+    run["statistics"] = loads(run["statistics"])
+    return run
+
+
+def select_runs(columns, status="finished", update_mode=None, **parameters):
+    """ Returns the given columns of all runs with the given status (None for any) and parameter values """
+    conditions = []
+    values = []
+    for name, value in [("status", status), ("update_mode", update_mode), *parameters.items()]:
+        if name not in ["status", "update_mode"] + CATALOG_PARAMETERS:
+            raise ValueError(f"Runs cannot be selected by {name}")
+        if value is not None:
+            conditions.append(f"{name} = ?")
+            values.append(value)
+
+    where = " WHERE " + " AND ".join(conditions) if len(conditions) > 0 else ""
+    connection = connect_catalog()
+    rows = connection.execute(f"SELECT {', '.join(columns)} FROM runs{where} ORDER BY id", values).fetchall()
+    connection.close()
+    return rows
+
+
+def find_runs(status="finished", update_mode=None, **parameters):
+    """ Returns the ids of all runs with the given status (None for any) and parameter values, e.g.
+    find_runs(rainfall=600, n=500) """
+    return [row["id"] for row in select_runs(["id"], status, update_mode, **parameters)]
+
+
+def load_catalog_series(parameter_name, observables, base_parameters, min_points=2):
+    """ Returns the values of a parameter and the run-averaged statistics (with their SDs) at each value, over
+    the finished runs whose other parameters equal base_parameters. Returns None if runs were found at fewer than
+    min_points values (the default runs of an ensemble alone are no series) """
+    if parameter_name not in CATALOG_PARAMETERS:
+        raise ValueError(f"Runs cannot be selected by {parameter_name}")
+    other_parameters = {name: base_parameters[name] for name in CATALOG_PARAMETERS
+                        if name != parameter_name and name in base_parameters}
 
-    file_name = 'simulation_{}.pkl'.format(num_automaton_simulations)
-    path_name = os.path.join(current_path, 'automaton_data', file_name)
-    dump(array(lattice_record, dtype=bool), open(path_name, 'wb'))
+    runs = {}
+    for row in select_runs([parameter_name, "statistics"], **other_parameters):
+        statistics = loads(row["statistics"])
+        if row[parameter_name] is not None and all(observable in statistics for observable in observables):
+            runs.setdefault(row[parameter_name], []).append(statistics)
+
+    if len(runs) < min_points:
+        return None
+
+    values = sorted(runs)
+    means = [array([mean([statistics[observable] for statistics in runs[value]]) for value in values])
+             for observable in observables]
+    sds = [array([std([statistics[observable] for statistics in runs[value]]) for value in values])
+           for observable in observables]
+    return array(values), means, sds
+
+
+def save_automaton_data(lattice_record, parameters=None, seed=None):
+    """ Saves the entire simulation data in a trajectory file under automaton_data, and returns its run id """
+    run_id = register_run(parameters, seed)
+    path = get_simulation_path(run_id)
+    with timed_metrics("io", operation="save", num_file=run_id) as fields:
+        write_trajectory(path, lattice_record)
+        fields["bytes"] = os.path.getsize(path)
+    finish_run(run_id)
+    return run_id
 
 
 def check_automaton_data():
     """ Checks how many simulation files are present in automaton_data """
-    current_path = os.path.dirname(__file__)
-    files_list = os.listdir(os.path.join(current_path, "automaton_data"))
+    return len(get_simulation_numbers())
 
-    num_automaton_simulations = 0
-    for file_name in files_list:
-        if file_name.startswith("simulation_") and file_name.endswith(".pkl"):
-            num_automaton_simulations += 1
 
-    return num_automaton_simulations
+def open_automaton_data(num_file):
+    """ Opens the trajectory of the simulation file with the given number, for reading frames lazily """
+    if not os.path.exists(get_simulation_path(num_file)):
+        raise ValueError("Invalid simulation file number")
+    return TrajectoryReader(get_simulation_path(num_file))
 
 
 def load_automaton_data(num_file):
     """ Loads the data from the simulation file with the given number """
-    num_simulations = check_automaton_data()
-    if num_file >= num_simulations:
+    if num_file not in get_simulation_numbers():
         raise ValueError("Invalid simulation file number")
 
-    current_path = os.path.dirname(__file__)
-    file_name = os.path.join(current_path, "automaton_data",
-                             "simulation_{}.pkl".format(num_file))
+    with timed_metrics("io", operation="load", num_file=num_file) as fields:
+        if os.path.exists(get_simulation_path(num_file)):
+            with open_automaton_data(num_file) as trajectory:
+                lattice_record = trajectory.read_frames()
+                fields["bytes"] = trajectory.bytes_read
+        else:
+            with open(get_simulation_path(num_file, "pkl"), "rb") as file:
+                lattice_record = as_lattice(asarray(load(file)))
+                fields["bytes"] = file.tell()
+    return lattice_record
+
+
+def load_automaton_frame(num_file, time_step=-1):
+    """ Loads the lattice at a single time step from the simulation file with the given number """
+    if os.path.exists(get_simulation_path(num_file)):
+        with timed_metrics("io", operation="load_frame", num_file=num_file) as fields, \
+                open_automaton_data(num_file) as trajectory:
+            lattice = trajectory.read_frame(time_step)
+            fields["bytes"] = trajectory.bytes_read
+        return lattice
+
+    return load_automaton_data(num_file)[time_step]
+
+
+def load_automaton_frames(num_file, time_steps):
+    """ Loads the lattices at the given (increasing) time steps from the simulation file with the given number """
+    if os.path.exists(get_simulation_path(num_file)):
+        with timed_metrics("io", operation="load_frames", num_file=num_file, num_frames=len(time_steps)) as fields, \
+                open_automaton_data(num_file) as trajectory:
+            frames = trajectory.read_time_steps(time_steps)
+            fields["bytes"] = trajectory.bytes_read
+        return frames
+
+    return load_automaton_data(num_file)[list(time_steps)]
+
+
+def count_automaton_frames(num_file):
+    """ Returns the number of time steps stored in the simulation file with the given number """
+    if os.path.exists(get_simulation_path(num_file)):
+        with open_automaton_data(num_file) as trajectory:
+            return len(trajectory)
+
+    return len(load_automaton_data(num_file))
+
+
+def get_common_time_steps(num_files, time_steps):
+    """ Returns the time steps that all of the simulation files with the given numbers have. Runs stopped once
+    equilibrated are shorter than mc_steps, and every time step of an ensemble analysis has to pool the same runs,
+    so the steps past the shortest run are dropped """
+    frame_counts = [count_automaton_frames(num_file) for num_file in num_files]
+    if len(frame_counts) == 0:
+        raise ValueError("No simulations were selected")
+    num_frames = min(frame_counts)
+    if num_frames != max(frame_counts):
+        print(f"The simulations have between {num_frames} and {max(frame_counts)} time steps")
+
+    common_time_steps = [time_step for time_step in time_steps if 0 <= time_step < num_frames]
+    if len(common_time_steps) < len(time_steps):
+        print(f"{len(time_steps) - len(common_time_steps)} time steps outside the {num_frames} time steps of the "
+              f"shortest simulation are dropped")
+    if len(common_time_steps) == 0:
+        raise ValueError(f"None of the time steps are within the {num_frames} time steps of the shortest simulation")
+    return common_time_steps
+
+
+def save_checkpoint(path, state):
+    """ Pickles the state of a simulation, writing to a temporary file first so that a crash never leaves
+    a partial checkpoint behind """
+    with timed_metrics("io", operation="checkpoint", path=path) as fields:
+        with open(path + ".tmp", "wb") as file:
+            dump(state, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(path + ".tmp", path)
+        fields["bytes"] = os.path.getsize(path)
+
+
+def load_checkpoint(path):
+    """ Loads the state of a simulation saved by save_checkpoint """
+    with open(path, "rb") as file:
+        return load(file)
+
+
+def get_checkpoint_numbers():
+    """ Returns the numbers of all simulations under automaton_data that have a checkpoint to resume from """
+    return get_simulation_numbers(extensions=("ckpt",))
+
+
+def convert_automaton_data(delete_pickles=False):
+    """ Converts every simulation_*.pkl file under automaton_data to the trajectory format """
+    for num_file in sorted(get_simulation_numbers(extensions=("pkl",))):
+        if not os.path.exists(get_simulation_path(num_file)):
+            print(f"Converting simulation_{num_file}.pkl")
+            convert_pickle_file(get_simulation_path(num_file, "pkl"), get_simulation_path(num_file))
+
+        if delete_pickles:
+            os.remove(get_simulation_path(num_file, "pkl"))
+
 
-    with open(file_name, "rb") as file:
-        return load(file)
\ No newline at end of file
+if __name__ == '__main__':
+    # converts the pickled simulations of older versions to the (much smaller) trajectory format
+    convert_automaton_data(delete_pickles=False)
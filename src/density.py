@@ -0,0 +1,94 @@
+# Precomputed neighbourhood stencil and incrementally maintained density field
+# The weightage of every cell in the neighbourhood depends only on r_influence and immediacy,
+# so it is computed once per parameter set instead of once per Monte Carlo proposal
+
+from math import sqrt
+from numba import njit
+from numpy import array, float64, int64, zeros
+from numpy.fft import irfft2, rfft2
+
+
+def make_stencil(r_influence, immediacy):
+    """ Returns the offsets (da, db) of the circular neighbourhood and their weightage terms """
+    offsets = []
+    weights = []
+
+    for da in range(-r_influence, r_influence + 1):
+        for db in range(-r_influence, r_influence + 1):
+            if da ** 2 + db ** 2 < r_influence ** 2:
+                offsets.append((da, db))
+                weights.append(1 - sqrt(da ** 2 + db ** 2) / immediacy)
+
+    return array(offsets, dtype=int64).reshape(-1, 2), array(weights, dtype=float64)
+
+
+@njit(fastmath=True, nogil=True, cache=True)
+def make_normalization(n, offsets, weights):
+    """ Calculates the sum of weightage terms in the neighbourhood of every cell """
+    normalization = zeros((n, n), dtype=float64)
+
+    for i in range(n):
+        for j in range(n):
+            for s in range(len(weights)):
+                a = i + offsets[s, 0]
+                b = j + offsets[s, 1]
+                if 0 < a < n and 0 < b < n:
+                    normalization[i, j] += weights[s]
+    return normalization
+
+
+@njit(fastmath=True, nogil=True, cache=True)
+def make_density_field(lattice, offsets, weights):
+    """ Calculates the (unnormalized) weighted vegetation in the neighbourhood of every cell """
+    n = len(lattice)
+    density = zeros((n, n), dtype=float64)
+
+    for i in range(n):
+        for j in range(n):
+            for s in range(len(weights)):
+                a = i + offsets[s, 0]
+                b = j + offsets[s, 1]
+                if 0 < a < n and 0 < b < n:
+                    density[i, j] += weights[s] * lattice[a, b]
+    return density
+
+
+@njit(fastmath=True, nogil=True, cache=True)
+def update_density_field(density, a, b, change, offsets, weights):
+    """ Updates the density field after the cell (a, b) changed its state by change (+1 or -1) """
+    n = len(density)
+
+    # cells on the first row and column never contribute to any neighbourhood
+    if a == 0 or b == 0:
+        return
+
+    # the stencil is symmetric, so (a, b) lies in the neighbourhood of (a - da, b - db)
+    for s in range(len(weights)):
+        i = a - offsets[s, 0]
+        j = b - offsets[s, 1]
+        if 0 <= i < n and 0 <= j < n:
+            density[i, j] += weights[s] * change
+
+
+def make_kernel_fft(n, offsets, weights):
+    """ Returns the Fourier transform of the stencil, zero padded for a linear convolution with an n x n lattice """
+    r_influence = offsets.max()
+    size = n + 2 * r_influence
+    kernel = zeros((size, size), dtype=float64)
+    kernel[offsets[:, 0] + r_influence, offsets[:, 1] + r_influence] = weights
+    return rfft2(kernel)
+
+
+def make_density_field_fft(lattice, kernel_fft):
+    """ Calculates the (unnormalized) density field of the whole lattice with a single FFT convolution """
+    n = len(lattice)
+    size = kernel_fft.shape[0]
+    r_influence = (size - n) // 2
+
+    # cells on the first row and column never contribute to any neighbourhood
+    contributing = zeros((n, n), dtype=float64)
+    contributing[1:, 1:] = lattice[1:, 1:]
+
+    # the stencil is symmetric, so the convolution equals the neighbourhood sum
+    convolution = irfft2(rfft2(contributing, s=(size, size)) * kernel_fft, s=(size, size))
+    return convolution[r_influence:r_influence + n, r_influence:r_influence + n]
@@ -0,0 +1,88 @@
+# Detection of equilibration (stationarity) in the time series of an observable
+# A series is taken to be stationary when the means of consecutive batches show no significant linear drift, and
+# the first batch does not deviate significantly from the rest (which catches transients too short to tilt a line):
+# batches longer than the autocorrelation time have (nearly) independent means, so the usual standard errors
+# apply to them. The equilibration time is the earliest start of a stationary tail that covers at least half of
+# the series, and the number of decorrelated samples after it follows from the integrated autocorrelation time
+
+from numpy import arange, asarray, cumsum, dot, mean, sqrt, std, sum
+from numpy.fft import irfft, rfft
+
+
+def get_batch_means(values, num_batches):
+    """ Returns the means of num_batches consecutive batches of equal length, dropping the first few values
+    if the series cannot be split evenly """
+    values = asarray(values, dtype=float)
+    batch_length = len(values) // num_batches
+    return values[len(values) - batch_length * num_batches:].reshape(num_batches, batch_length).mean(axis=1)
+
+
+def get_drift(values, num_batches=10):
+    """ Fits a line to the batch means of a series, returns the drift over the whole series and its t statistic """
+    batch_means = get_batch_means(values, num_batches)
+    x = arange(num_batches) - (num_batches - 1) / 2
+    slope = dot(x, batch_means) / dot(x, x)
+
+    residuals = batch_means - mean(batch_means) - slope * x
+    standard_error = sqrt(sum(residuals ** 2) / (num_batches - 2) / dot(x, x))
+    drift = slope * num_batches
+    if standard_error == 0:
+        return drift, 0.0 if slope == 0 else float("inf")
+    return drift, abs(slope) / standard_error
+
+
+def get_initial_offset(values, num_batches=10):
+    """ Returns the deviation of the first batch mean from the mean of the others, and its t statistic """
+    batch_means = get_batch_means(values, num_batches)
+    offset = batch_means[0] - mean(batch_means[1:])
+    standard_error = std(batch_means[1:], ddof=1) * sqrt(1 + 1 / (num_batches - 1))
+    if standard_error == 0:
+        return offset, 0.0 if offset == 0 else float("inf")
+    return offset, abs(offset) / standard_error
+
+
+def is_stationary(values, num_batches=10, threshold=2.5, tolerance=0.0):
+    """ Checks whether a series has neither a significant drift nor a significant initial offset, ignoring
+    either if it is smaller than the tolerance """
+    for deviation, t_statistic in [get_drift(values, num_batches), get_initial_offset(values, num_batches)]:
+        if t_statistic >= threshold and abs(deviation) >= tolerance:
+            return False
+    return True
+
+
+def find_equilibration_time(values, num_batches=10, threshold=2.5, tolerance=0.0, num_starts=20):
+    """ Returns the first of num_starts candidate indices in the first half of the series from which on it is
+    stationary, or None if there is none (or the series is too short to be tested) """
+    if len(values) < 4 * num_batches:
+        return None
+
+    half = len(values) // 2
+    for start in range(0, half + 1, max(half // num_starts, 1)):
+        if is_stationary(values[start:], num_batches, threshold, tolerance):
+            return start
+    return None
+
+
+def get_autocorrelation_time(values, window_factor=5):
+    """ Returns the integrated autocorrelation time of a series, summing its autocorrelation function up to the
+    first lag larger than window_factor times the running estimate (Sokal's automatic window) """
+    values = asarray(values, dtype=float)
+    fluctuations = values - mean(values)
+    variance = dot(fluctuations, fluctuations)
+    if variance == 0:
+        return 0.5
+
+    # the autocorrelation function by FFT, zero-padded to avoid wrapping around
+    spectrum = rfft(fluctuations, 2 * len(values))
+    autocorrelation = irfft(spectrum * spectrum.conjugate())[:len(values)] / variance
+
+    times = cumsum(autocorrelation) - 0.5
+    for lag in range(1, len(values)):
+        if lag >= window_factor * times[lag]:
+            return max(float(times[lag]), 0.5)
+    return float(times[-1])
+
+
+def count_decorrelated_samples(values):
+    """ Returns the number of effectively independent samples in a (stationary) series """
+    return len(values) / (2 * get_autocorrelation_time(values))
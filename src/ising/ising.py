@@ -4,19 +4,20 @@
 # animates only 1% of all steps
 
 from math import exp
-from matplotlib import pyplot as plt
-from matplotlib.animation import FuncAnimation
 from numba import njit
-from numpy import copy, sum, zeros
-from random import random
+from numpy import abs, copy, empty, float64, indices, int32, int64, pad, sum, where, zeros
+from time import perf_counter
+import os
+import sys
 
+# the cluster labeling, random number streams and autocorrelation estimator of the automaton (one folder up) are reused
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from cluster import label_bonds
+from equilibration import get_autocorrelation_time
+from rng import draw_seed, get_stream, get_uniforms
 
-def animate(i):
-    im.set_array(spins_record[i])
-    return [im]
 
-
-@njit
+@njit(cache=True)
 def calc_energy(spins):
     n = len(spins)
     energy = 0
@@ -34,56 +35,222 @@ def calc_energy(spins):
     return energy
 
 
-if __name__ == '__main__':
-    n = 100
-    J = 1
-    T = 1
-    kB = 1
-    mc_steps = 100000
+def make_acceptance_table(beta, J):
+    """ Tabulates min(1, exp(-beta dE)) for dE = 2 J s h, indexed by s h + 4 (h is the sum of the neighbouring spins) """
+    table = empty(9, dtype=float64)
+    for s_h in range(-4, 5):
+        table[s_h + 4] = min(1.0, exp(-beta * 2 * J * s_h))
+    return table
+
+
+@njit(fastmath=True, cache=True)
+def local_field(spins, i, j):
+    """ Calculates the sum of the (up to 4) neighbouring spins of (i, j), with open boundaries """
+    n = len(spins)
+    h = 0.0
+    if i > 0:
+        h += spins[i - 1, j]
+    if i < n - 1:
+        h += spins[i + 1, j]
+    if j > 0:
+        h += spins[i, j - 1]
+    if j < n - 1:
+        h += spins[i, j + 1]
+    return h
+
+
+@njit(fastmath=True, cache=True)
+def metropolis(spins, acceptance, J, state, M_record, uniforms):
+    """ Performs len(M_record) single spin-flip Metropolis proposals, with dE calculated from the neighbours
+    Every row of the (len(M_record), 3) uniforms selects a spin (i, j) and decides its flip
+    state holds the energy and magnetisation, which are updated on every accepted flip """
+    n = len(spins)
+
+    for step in range(len(M_record)):
+        i = int(uniforms[step, 0] * n)
+        j = int(uniforms[step, 1] * n)
+        s_h = spins[i, j] * local_field(spins, i, j)
+
+        if uniforms[step, 2] < acceptance[int(s_h) + 4]:
+            spins[i, j] *= -1
+            state[0] += 2 * J * s_h
+            state[1] += 2 * spins[i, j]
 
+        M_record[step] = state[1]
+
+
+def checkerboard_sweep(spins, acceptance, J, state, stream):
+    """ Updates all spins of one sublattice of the checkerboard at once, then the other (n^2 proposals)
+    The spins of a sublattice do not interact, so they can be flipped simultaneously """
+    n = len(spins)
+    i, j = indices((n, n))
+
+    for parity in range(2):
+        padded = pad(spins, 1)
+        h = padded[:-2, 1:-1] + padded[2:, 1:-1] + padded[1:-1, :-2] + padded[1:-1, 2:]
+        s_h = (spins * h).astype(int)
+
+        flips = ((i + j) % 2 == parity) & (stream.random((n, n)) < acceptance[s_h + 4])
+        spins[flips] *= -1
+
+    state[0] = -J * calc_energy(spins)
+    state[1] = sum(spins)
+
+
+@njit(cache=True)
+def wolff_step(spins, p_add, stack, uniforms, position):
+    """ Grows a single cluster of aligned spins from a random seed, adding each aligned neighbour with
+    probability p_add = 1 - exp(-2 beta J), and flips it. The draws are taken from uniforms[position:],
+    which needs at most 2 + 4 n^2 of them. Returns the cluster size and the position of the next draw """
+    n = len(spins)
+    i = int(uniforms[position] * n)
+    j = int(uniforms[position + 1] * n)
+    position += 2
+    cluster_spin = spins[i, j]
+
+    # spins are flipped as they join, so flipped spins are never added twice
+    spins[i, j] = -cluster_spin
+    stack[0] = i * n + j
+    top = 1
+    cluster_size = 1
+
+    while top > 0:
+        top -= 1
+        x, y = stack[top] // n, stack[top] % n
+        for a, b in ((x - 1, y), (x + 1, y), (x, y - 1), (x, y + 1)):
+            if 0 <= a < n and 0 <= b < n and spins[a, b] == cluster_spin:
+                position += 1
+                if uniforms[position - 1] < p_add:
+                    spins[a, b] = -cluster_spin
+                    stack[top] = a * n + b
+                    top += 1
+                    cluster_size += 1
+    return cluster_size, position
+
+
+def wolff_sweep(spins, p_add, J, state, stack, stream):
+    """ Performs Wolff cluster updates until n^2 spins have been flipped in total (one sweep) """
+    n = len(spins)
+    max_draws = 2 + 4 * n * n
+    uniforms = stream.random(2 * max_draws)
+    position = 0
+
+    flipped = 0
+    while flipped < n * n:
+        if position + max_draws > len(uniforms):
+            uniforms = stream.random(2 * max_draws)
+            position = 0
+        cluster_size, position = wolff_step(spins, p_add, stack, uniforms, position)
+        flipped += cluster_size
+
+    state[0] = -J * calc_energy(spins)
+    state[1] = sum(spins)
+
+
+def swendsen_wang_sweep(spins, p_add, J, state, stream):
+    """ Activates the bond between each pair of aligned neighbours with probability p_add = 1 - exp(-2 beta J),
+    labels the resulting clusters and flips each of them with probability 1/2 """
+    n = len(spins)
+    right_bonds = (spins[:, :-1] == spins[:, 1:]) & (stream.random((n, n - 1)) < p_add)
+    down_bonds = (spins[:-1, :] == spins[1:, :]) & (stream.random((n - 1, n)) < p_add)
+
+    labels = empty((n, n), dtype=int32)
+    num_clusters = label_bonds(right_bonds, down_bonds, labels)
+    flip_cluster = stream.random(num_clusters + 1) < 0.5
+    spins *= where(flip_cluster[labels], -1, 1)
+
+    state[0] = -J * calc_energy(spins)
+    state[1] = sum(spins)
+
+
+def run_ising(n, J, T, mc_steps, algorithm="metropolis", seed=None, kB=1):
+    """ Simulates the Ising model from a random state with the given algorithm, printing the autocorrelation time
+    of |M| and the cost of an independent sample. Returns the spins recorded at 1/1000 of the steps
+    (every sweep for the cluster algorithms) """
     beta = 1 / (kB * T)
-    spins = zeros((n, n))
     spins_record = []
     M_record = zeros(mc_steps)
 
     record_factor = 1 / 1000
     record_step = int(mc_steps * record_factor)
 
-    for i in range(n):
-        for j in range(n):
-            spins[i][j] = 1 if random() > 0.5 else -1
-
-    for steps in range(mc_steps):
-        rand_i = int(random() * n)
-        rand_j = int(random() * n)
-
-        init_energy = -J * calc_energy(spins)
-        spins[rand_i][rand_j] *= -1
-        final_energy = -J * calc_energy(spins)
-        dE = final_energy - init_energy
-
-        if dE <= 0:
-            pass
-        else:
-            if random() < exp(-beta * dE):
-                pass
-            else:
-                spins[rand_i][rand_j] *= -1
+    if seed is None:
+        seed = draw_seed()
+    print(f"Seed: {seed}")
+    spins = where(get_stream(seed, -1).random((n, n)) > 0.5, 1.0, -1.0)
 
-        M_record[steps] = sum(spins)
+    acceptance = make_acceptance_table(beta, J)
+    p_add = 1 - exp(-2 * beta * J)
+    stack = zeros(n * n, dtype=int64)
+    state = zeros(2)
+    state[0] = -J * calc_energy(spins)
+    state[1] = sum(spins)
 
-        if steps % record_step == 0:
+    start_time = perf_counter()
+    if algorithm == "metropolis":
+        for steps in range(0, mc_steps, record_step):
             print("{:.1f} %".format(steps / mc_steps * 100))
             spins_record.append(copy(spins))
+            uniforms = get_uniforms(seed, steps // record_step, (record_step, 3))
+            metropolis(spins, acceptance, J, state, M_record[steps:steps + record_step], uniforms)
+
+        # magnetisation once per sweep, for comparison with the other algorithms
+        M_sweeps = M_record[n * n - 1::n * n]
+    elif algorithm in ["checkerboard", "wolff", "swendsen_wang"]:
+        num_sweeps = mc_steps // (n * n)
+        M_sweeps = zeros(num_sweeps)
+        for sweep in range(num_sweeps):
+            print("{:.1f} %".format(sweep / num_sweeps * 100))
+            spins_record.append(copy(spins))
+            stream = get_stream(seed, sweep)
+            if algorithm == "checkerboard":
+                checkerboard_sweep(spins, acceptance, J, state, stream)
+            elif algorithm == "wolff":
+                wolff_sweep(spins, p_add, J, state, stack, stream)
+            else:
+                swendsen_wang_sweep(spins, p_add, J, state, stream)
+            M_sweeps[sweep] = state[1]
+    else:
+        raise ValueError("Invalid algorithm")
+    elapsed_time = perf_counter() - start_time
+
+    # the cost of an independent sample is 2 tau sweeps
+    tau = get_autocorrelation_time(abs(M_sweeps))
+    time_per_sweep = elapsed_time / max(len(M_sweeps), 1)
+    print(f"Integrated autocorrelation time of |M|: {tau:.2f} sweeps")
+    print(f"Time per sweep: {time_per_sweep:.3g} s, time per independent sample: {2 * tau * time_per_sweep:.3g} s")
+    return spins_record
+
+
+def animate_spins(spins_record):
+    from matplotlib import pyplot as plt
+    from matplotlib.animation import FuncAnimation
 
     fig = plt.figure()
     im = plt.imshow(spins_record[0])
 
-    num_frames = len(spins_record)
+    def animate(i):
+        im.set_array(spins_record[i])
+        return [im]
+
+    animation = FuncAnimation(fig, animate, frames=len(spins_record), interval=1, repeat=False)
+    plt.show()
+
+
+if __name__ == '__main__':
+    n = 100
+    J = 1
+    T = 1
+    kB = 1
+    mc_steps = 100000
+
+    # "metropolis" flips one random spin per step, "checkerboard" updates a whole sublattice
+    # at once, "wolff" and "swendsen_wang" flip whole clusters (which avoids the critical
+    # slowing down near T_c). Except for metropolis, mc_steps is rounded to whole sweeps of n * n spins
+    algorithm = "metropolis"
+
+    # seed = None draws a fresh seed (printed for reproduction), every block of steps has its own stream
+    seed = None
 
-    animate = FuncAnimation(fig,
-                            animate,
-                            frames=num_frames,
-                            interval=1,
-                            repeat=False)
-    plt.show()
\ No newline at end of file
+    spins_record = run_ising(n, J, T, mc_steps, algorithm, seed, kB)
+    animate_spins(spins_record)
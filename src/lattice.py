@@ -0,0 +1,33 @@
+# Compact representation of the (binary) vegetation lattice, shared by the whole pipeline
+# Lattices are uint8 arrays of 0 (empty) and 1 (vegetation): 1 byte per cell instead of the 8 of int64,
+# which mc_step, the density field, cluster labeling, the observers and the trajectory files all accept
+# without conversion. Boolean lattices are reinterpreted as uint8 without copying. Lattices that are kept
+# for long (e.g. snapshots) can be bit-packed row by row, which takes 1 bit per cell
+
+from numpy import bool_, packbits, uint8, unpackbits
+
+lattice_dtype = uint8
+
+
+def make_random_lattice(n, stream, occupancy=0.5):
+    """ Returns an n x n lattice whose cells are occupied with the given probability, drawn from a numpy Generator """
+    return (stream.random((n, n)) > 1 - occupancy).view(lattice_dtype)
+
+
+def as_lattice(array):
+    """ Returns an array of 0 and 1 as a lattice, copying only if it is neither uint8 nor boolean """
+    if array.dtype == lattice_dtype:
+        return array
+    if array.dtype == bool_:
+        return array.view(lattice_dtype)
+    return (array != 0).view(lattice_dtype)
+
+
+def pack_lattice(lattice):
+    """ Bit-packs every row of a lattice, returns an (n, ceil(n / 8)) uint8 array """
+    return packbits(lattice, axis=1)
+
+
+def unpack_lattice(packed_lattice, n):
+    """ Restores a lattice bit-packed by pack_lattice """
+    return unpackbits(packed_lattice, axis=1, count=n)
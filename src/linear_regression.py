@@ -5,7 +5,7 @@
 from numba import njit
 from numpy import mean, sum
 
-@njit
+@njit(cache=True)
 def perform_linear_regression(x, y):
     """ Performs a linear regression on the data """
     x_mean = mean(x)
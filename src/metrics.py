@@ -0,0 +1,101 @@
+# Structured metrics of the simulation and analysis pipeline
+# Records are appended as JSON lines (one JSON object per line) to the file given to enable_metrics, and
+# every record carries its event name, a timestamp, the process id and the context of the process (such as
+# the ensemble member it simulates), so the streams of all worker processes can share a single file.
+# Metrics are disabled by default: emit_metrics then returns immediately and mc_step runs without
+# counters, so the instrumentation costs (almost) nothing
+
+from collections import defaultdict
+from contextlib import contextmanager
+from json import dumps, loads
+from time import perf_counter, time
+import os
+
+metrics_file = None
+metrics_context = {}
+
+
+def enable_metrics(path, **context):
+    """ Appends the metrics of this process to the given file, adding the given context fields to every record """
+    global metrics_file
+    disable_metrics()
+
+    # line buffered, so that every record reaches the file with a single (append) write
+    metrics_file = open(path, "a", buffering=1)
+    metrics_context.update(context)
+
+
+def disable_metrics():
+    global metrics_file
+    if metrics_file is not None:
+        metrics_file.close()
+    metrics_file = None
+    metrics_context.clear()
+
+
+def metrics_enabled():
+    return metrics_file is not None
+
+
+def get_metrics_path():
+    """ Returns the path of the metrics file (None while disabled), to enable metrics in worker processes """
+    return metrics_file.name if metrics_file is not None else None
+
+
+def emit_metrics(event, **fields):
+    """ Writes a single record, if metrics are enabled """
+    if metrics_file is None:
+        return
+    record = {"event": event, "time": time(), "pid": os.getpid(), **metrics_context, **fields}
+    metrics_file.write(dumps(record) + "\n")
+
+
+@contextmanager
+def timed_metrics(event, **fields):
+    """ Emits a record with the duration of the enclosed block, fields added to the yielded dict are included """
+    if metrics_file is None:
+        yield fields
+        return
+
+    start_time = perf_counter()
+    yield fields
+    emit_metrics(event, duration=perf_counter() - start_time, **fields)
+
+
+def load_metrics(path):
+    """ Reads all records of a metrics file """
+    with open(path) as file:
+        return [loads(line) for line in file if line.strip()]
+
+
+def summarize_metrics(records):
+    """ Prints the step times, acceptance rates and I/O totals of the given records """
+    steps = [record for record in records if record["event"] == "step"]
+    if len(steps) > 0:
+        step_time = sum(record["step_time"] for record in steps)
+        observer_time = sum(record["observer_time"] for record in steps)
+        proposals = sum(record["growth_proposals"] + record["decay_proposals"] for record in steps)
+        print(f"{len(steps)} steps: {step_time:.2f} s in mc_step, {observer_time:.2f} s in observers")
+        print(f"    {proposals / step_time:.3g} proposals / second")
+
+        for kind, accepted in [("growth", "growths"), ("decay", "decays")]:
+            num_proposals = sum(record[kind + "_proposals"] for record in steps)
+            num_accepted = sum(record[accepted] for record in steps)
+            print(f"    {kind.capitalize()} acceptance rate: {num_accepted / max(num_proposals, 1):.4f}")
+
+    io_totals = defaultdict(lambda: [0, 0, 0.0])
+    for record in records:
+        if record["event"] == "io":
+            totals = io_totals[record["operation"]]
+            totals[0] += 1
+            totals[1] += record.get("bytes", 0)
+            totals[2] += record["duration"]
+
+    for operation, (count, num_bytes, duration) in io_totals.items():
+        print(f"{operation}: {count} calls, {num_bytes / 2 ** 20:.2f} MiB in {duration:.2f} s")
+
+
+if __name__ == '__main__':
+    # the metrics file written by a run with metrics enabled (see automaton.py)
+    metrics_path = os.path.join(os.path.dirname(__file__), "metrics.jsonl")
+    summarize_metrics(load_metrics(metrics_path))
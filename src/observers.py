@@ -0,0 +1,173 @@
+# Observers that measure the automaton inside the simulation loop
+# Every observer is called with observe(step, lattice) after each Monte Carlo step, and with
+# finish(lattice) at the end of the simulation, so that only what is needed is kept in memory
+# Observers that need the initial lattice also define start(lattice)
+# Observers are pickled into the checkpoints of a simulation, and restored from them when it resumes
+# An observer can end the simulation early by setting its stop attribute, mc_steps is then only an upper limit
+
+from numpy import flatnonzero, isnan, sum
+import os
+
+from cluster import cluster_lattice
+from cluster_tracking import make_tracker
+from equilibration import count_decorrelated_samples, find_equilibration_time
+from lattice import pack_lattice
+from metrics import timed_metrics
+from power_law import fit_probabilities, get_lattice_probabilities
+from trajectory import TrajectoryWriter
+
+
+class ForestCoverObserver:
+    """ Records the forest cover after every step """
+
+    def __init__(self):
+        self.forest_cover = []
+
+    def observe(self, step, lattice):
+        self.forest_cover.append(sum(lattice) / lattice.size)
+
+    def finish(self, lattice):
+        pass
+
+
+class ClusterHistogramObserver:
+    """ Records the number of clusters of each size, every stride steps """
+
+    def __init__(self, stride=10):
+        self.stride = stride
+        self.time_steps = []
+        self.cluster_sizes = []
+
+    def observe(self, step, lattice):
+        if step % self.stride == 0:
+            self.time_steps.append(step)
+            self.cluster_sizes.append(cluster_lattice(lattice, trim=True))
+
+    def finish(self, lattice):
+        pass
+
+
+class TrackedClusterObserver:
+    """ Records the number of clusters of each size every stride steps, from a tracker that mc_step
+    updates on every flip, instead of relabeling the whole lattice """
+
+    def __init__(self, stride=1):
+        self.stride = stride
+        self.tracker = None
+        self.time_steps = []
+        self.cluster_sizes = []
+
+    def start(self, lattice):
+        self.tracker = make_tracker(lattice)
+
+    def observe(self, step, lattice):
+        if step % self.stride == 0:
+            histogram = self.tracker[3]
+            self.time_steps.append(step)
+            self.cluster_sizes.append(histogram[:flatnonzero(histogram)[-1] + 1].copy())
+
+    def finish(self, lattice):
+        pass
+
+
+class SnapshotObserver:
+    """ Keeps a copy of the lattice every stride steps, and of the final lattice
+    With packed, the snapshots are bit-packed (see lattice.unpack_lattice), which takes 8 times less memory """
+
+    def __init__(self, stride=1, packed=False):
+        self.stride = stride
+        self.packed = packed
+        self.time_steps = []
+        self.snapshots = []
+        self.final_lattice = None
+
+    def observe(self, step, lattice):
+        if step % self.stride == 0:
+            self.time_steps.append(step)
+            self.snapshots.append(pack_lattice(lattice) if self.packed else lattice.copy())
+
+    def finish(self, lattice):
+        self.final_lattice = lattice.copy()
+
+
+class TrajectoryObserver:
+    """ Writes every stride-th lattice directly to a trajectory file
+    The file is only created in start, so that a resumed simulation continues the file of its checkpoint """
+
+    def __init__(self, path, n, stride=1, **options):
+        self.path = path
+        self.n = n
+        self.stride = stride
+        self.options = options
+        self.writer = None
+
+    def start(self, lattice):
+        self.writer = TrajectoryWriter(self.path, self.n, **self.options)
+
+    def observe(self, step, lattice):
+        if step % self.stride == 0:
+            self.writer.write_frame(lattice)
+
+    def finish(self, lattice):
+        # the writes of single frames are timed with the observers of every step
+        with timed_metrics("io", operation="write_trajectory", path=self.path) as fields:
+            self.writer.close()
+            fields["bytes"] = os.path.getsize(self.path)
+
+
+class EquilibrationObserver:
+    """ Detects equilibration online, from the forest cover after every step and the cluster exponent beta every
+    beta_stride steps, both being tested for drift every check_interval steps (see equilibration.py)
+    Once both are stationary, the simulation is stopped as soon as the forest cover after the equilibration time
+    holds num_samples decorrelated samples (num_samples = 0 stops at equilibration, None never stops) """
+
+    def __init__(self, num_samples=None, beta_stride=2, check_interval=10, threshold=2.5, tolerance=0.0):
+        self.num_samples = num_samples
+        self.beta_stride = beta_stride
+        self.check_interval = check_interval
+        self.threshold = threshold
+        self.tolerance = tolerance
+
+        self.forest_cover = []
+        self.beta_steps = []
+        self.beta = []
+        self.equilibration_time = None
+        self.decorrelated_samples = 0.0
+        self.stop = False
+
+    def observe(self, step, lattice):
+        self.forest_cover.append(sum(lattice) / lattice.size)
+        if step % self.beta_stride == 0:
+            self.beta_steps.append(step)
+            self.beta.append(fit_probabilities(get_lattice_probabilities(lattice))[0])
+
+        if (step + 1) % self.check_interval == 0:
+            self.check()
+
+    def check(self):
+        if self.equilibration_time is None:
+            forest_cover_time = find_equilibration_time(self.forest_cover, threshold=self.threshold,
+                                                        tolerance=self.tolerance)
+
+            # steps whose lattice had no power law to fit (nan) are skipped
+            beta_steps = [step for step, beta in zip(self.beta_steps, self.beta) if not isnan(beta)]
+            beta_index = find_equilibration_time([beta for beta in self.beta if not isnan(beta)],
+                                                 threshold=self.threshold)
+            if forest_cover_time is None or beta_index is None:
+                return
+            self.equilibration_time = max(forest_cover_time, beta_steps[beta_index])
+
+        self.decorrelated_samples = count_decorrelated_samples(self.forest_cover[self.equilibration_time:])
+        self.stop = self.num_samples is not None and self.decorrelated_samples >= self.num_samples
+
+    def finish(self, lattice):
+        pass
+
+    def get_statistics(self):
+        """ Returns what is recorded with a run: whether and when it equilibrated, and its length """
+        return {
+            "equilibrated": self.equilibration_time is not None,
+            "equilibration_time": self.equilibration_time,
+            "decorrelated_samples": float(self.decorrelated_samples),
+            "num_steps": len(self.forest_cover),
+        }
@@ -1,13 +1,13 @@
 # Averages the final result from an ensemble for simulations
 # and plots a log-log graph that conveys power law clustering
 
-from copy import copy
-from matplotlib import pyplot as plt
-from numpy import around, log, pad, sum, zeros
+from numpy import around, cumsum, log, nan, sum
 
 from cluster import cluster_lattice
-from data_manager import load_automaton_data
+from cluster_cache import cluster_cache
+from data_manager import find_runs
 from linear_regression import perform_linear_regression
+from power_law_mle import fit_cluster_sizes, merge_histograms
 
 
 def fit_power_law(log_area, log_prob):
@@ -18,18 +18,36 @@ def fit_power_law(log_area, log_prob):
 
 def get_probabilities(simulation_index, time_step = -1):
     """ Returns an array such that the i^th element is the probability of that any cluster has area greater than or equal to i """
-    lattice_record = load_automaton_data(simulation_index)
-    final_cluster_sizes = cluster_lattice(lattice_record[time_step], trim=True)
-    cumulative_cluster_sizes = copy(final_cluster_sizes[1:])
+    return get_cluster_probabilities(cluster_cache.get_cluster_sizes(simulation_index, time_step))
 
-    for i in range(len(cumulative_cluster_sizes)):
-        for j in range(i + 1, len(cumulative_cluster_sizes)):
-            cumulative_cluster_sizes[i] += cumulative_cluster_sizes[j]
+
+def get_lattice_probabilities(lattice):
+    """ Returns the cluster area probabilities of get_probabilities, for a lattice that is already in memory """
+    return get_cluster_probabilities(cluster_lattice(lattice, trim=True))
+
+
+def get_cluster_probabilities(final_cluster_sizes):
+    """ Returns the cluster area probabilities of get_probabilities, from a (trimmed) cluster size histogram """
+    # number of clusters with area >= i, accumulated from the largest area downwards
+    cumulative_cluster_sizes = cumsum(final_cluster_sizes[:0:-1])[::-1]
     probabilities = cumulative_cluster_sizes / sum(final_cluster_sizes[1:])
 
     return probabilities
 
 
+def fit_probabilities(probabilities):
+    """ Fits a power law to cluster area probabilities, returns the (positive) exponent beta, intercept and r_squared
+    Lattices without clusters of at least two different sizes have no power law to fit, and return nan """
+    if len(probabilities) == 0:
+        return nan, nan, nan
+    log_probabilities = trim_log_probabilities(log(probabilities))
+    if len(log_probabilities) < 2:
+        return nan, nan, nan
+    log_areas = log(range(1, len(log_probabilities) + 1))
+    beta, c, r_squared = fit_power_law(log_areas, log_probabilities)
+    return -beta, c, r_squared
+
+
 def trim_log_probabilities(y):
     """ Trims the last few repetitive elements of log_probabilities """
     last_value = y[-1]
@@ -43,24 +61,17 @@ def trim_log_probabilities(y):
     return y[:start_index + 1]
 
 
-if __name__ == '__main__':
-    # simulations that need to be considered
-    simulation_indices = list(range(0, 10))
-    ensemble_probabilities = []
-
+def analyse_ensemble(simulation_indices, show_plot=True):
+    """ Fits a power law to the pooled final cluster size distribution of the given simulations, by least squares
+    and by maximum likelihood, and plots the least squares fit """
+    ensemble_cluster_sizes = []
     for i, simulation_index in enumerate(simulation_indices):
         print(f"Lattice {i + 1} / {len(simulation_indices)} being processed")
-        probabilities = get_probabilities(simulation_index)
-        ensemble_probabilities.append(probabilities)
-
-    max_length = max([len(probabilities) for probabilities in ensemble_probabilities])
-    averaged_probability = zeros(max_length, dtype=float)
+        ensemble_cluster_sizes.append(cluster_cache.get_cluster_sizes(simulation_index))
 
-    for probabilities in ensemble_probabilities:
-        padded_probabilities = pad(probabilities, (0, max_length - len(probabilities)), mode="constant", constant_values=0)
-        averaged_probability += padded_probabilities
-
-    averaged_probability /= len(ensemble_probabilities)
+    # the clusters of all simulations are pooled into a single distribution
+    merged_cluster_sizes = merge_histograms(ensemble_cluster_sizes)
+    probabilities = get_cluster_probabilities(merged_cluster_sizes)
 
     log_probabilities = trim_log_probabilities(log(probabilities))
     log_areas = log(range(1, len(log_probabilities) + 1))
@@ -70,6 +81,14 @@ if __name__ == '__main__':
     print(f"Beta: {beta}")
     print(f"R^2: {r_squared}")
 
+    mle_beta, a_min, ks_distance, (beta_lower, beta_upper) = fit_cluster_sizes(merged_cluster_sizes)
+    print(f"Maximum likelihood beta: {mle_beta} (95% CI {beta_lower} - {beta_upper}), for areas >= {a_min}, KS distance {ks_distance}")
+    cluster_cache.print_statistics()
+
+    if not show_plot:
+        return
+
+    from matplotlib import pyplot as plt
     y_line = -beta * log_areas + c
     plt.title(f"Power law distribution of cluster sizes")
     plt.xlabel("log(a)")
@@ -77,4 +96,10 @@ if __name__ == '__main__':
     plt.plot(log_areas, log_probabilities, marker="o", linestyle="None", markersize=2)
     plt.plot(log_areas, y_line)
     plt.legend([f"Cluster data from {len(simulation_indices)} simulations", f"Power law fit with beta = {around(beta, 2)}, R^2 = {around(r_squared, 2)}"])
-    plt.show()
\ No newline at end of file
+    plt.show()
+
+
+if __name__ == '__main__':
+    # simulations that need to be considered, selected from the catalog by their parameters (e.g. {"rainfall": 600})
+    selection = {}
+    analyse_ensemble(find_runs(**selection))
@@ -0,0 +1,172 @@
+# Discrete maximum likelihood fitting of power laws to cluster size histograms
+#
+# For cluster sizes a >= a_min, P(A = a) = a^(-alpha) / zeta(alpha, a_min), where zeta is the Hurwitz zeta
+# function. a_min is chosen by minimizing the Kolmogorov-Smirnov distance between the data and the fit
+# (Clauset, Shalizi & Newman, 2009). The exponent beta of P(A >= a) ~ a^(-beta), which the least-squares
+# fits of power_law.py estimate, is alpha - 1.
+
+from math import log, nan
+from numba import njit, prange
+from numpy import array, cumsum, empty, float64, int64, isnan, percentile, searchsorted, zeros
+from numpy.random import random
+
+# Bernoulli numbers B2, B4, ..., B12 divided by their factorials, for the Euler-Maclaurin tail of zeta
+BERNOULLI_TERMS = array([1 / 12, -1 / 720, 1 / 30240, -1 / 1209600, 1 / 47900160, -691 / 1307674368000])
+
+MIN_ALPHA = 1.01
+MAX_ALPHA = 6.0
+
+
+@njit(fastmath=True, nogil=True, cache=True)
+def hurwitz_zeta(s, q):
+    """ Calculates the Hurwitz zeta function sum((q + k)^(-s)) for s > 1, q > 0 by Euler-Maclaurin summation """
+    num_terms = 10
+    value = 0.0
+    for k in range(num_terms):
+        value += (q + k) ** -s
+
+    x = q + num_terms
+    value += x ** (1 - s) / (s - 1) + 0.5 * x ** -s
+
+    # rising factorial s (s + 1) ... (s + 2j - 2), multiplied by x^(-s - 2j + 1)
+    factor = s * x ** (-s - 1)
+    for j in range(len(BERNOULLI_TERMS)):
+        value += BERNOULLI_TERMS[j] * factor
+        factor *= (s + 2 * j + 1) * (s + 2 * j + 2) / (x * x)
+    return value
+
+
+@njit(fastmath=True, nogil=True, cache=True)
+def fit_alpha(num_tail, log_sum, a_min):
+    """ Maximizes the log-likelihood -n log(zeta(alpha, a_min)) - alpha sum(log(a)) by golden-section search """
+    ratio = 0.6180339887498949
+    low, high = MIN_ALPHA, MAX_ALPHA
+
+    for _ in range(60):
+        left = high - ratio * (high - low)
+        right = low + ratio * (high - low)
+        likelihood_left = -num_tail * log(hurwitz_zeta(left, a_min)) - left * log_sum
+        likelihood_right = -num_tail * log(hurwitz_zeta(right, a_min)) - right * log_sum
+        if likelihood_left < likelihood_right:
+            low = left
+        else:
+            high = right
+    return 0.5 * (low + high)
+
+
+@njit(fastmath=True, nogil=True, cache=True)
+def ks_distance(cluster_sizes, a_min, alpha, num_tail):
+    """ Calculates the largest difference between the empirical and fitted P(A >= a) for a >= a_min """
+    zeta_min = hurwitz_zeta(alpha, a_min)
+    zeta_a = zeta_min
+    remaining = num_tail
+    distance = 0.0
+
+    for a in range(a_min, len(cluster_sizes)):
+        # both are P(A >= a), zeta(alpha, a + 1) = zeta(alpha, a) - a^(-alpha)
+        difference = abs(remaining / num_tail - zeta_a / zeta_min)
+        if difference > distance:
+            distance = difference
+        remaining -= cluster_sizes[a]
+        zeta_a -= a ** -alpha
+    return distance
+
+
+@njit(fastmath=True, nogil=True, cache=True)
+def fit_histogram(cluster_sizes, a_min, min_tail_clusters):
+    """ Fits alpha to a cluster size histogram for the given a_min, or for the a_min with the smallest
+    KS distance if a_min is 0. Returns alpha, a_min and the KS distance, which are nan, 0 and nan if the tail
+    has no clusters (or no a_min leaves min_tail_clusters in the tail) """
+    k = len(cluster_sizes)
+
+    # number of clusters and sum of log(a) in the tails a >= a_min, for every a_min
+    num_tail = zeros(k + 1, dtype=int64)
+    log_sum = zeros(k + 1, dtype=float64)
+    for a in range(k - 1, 0, -1):
+        num_tail[a] = num_tail[a + 1] + cluster_sizes[a]
+        log_sum[a] = log_sum[a + 1] + cluster_sizes[a] * log(a)
+
+    if a_min > 0:
+        if num_tail[a_min] == 0:
+            return nan, a_min, nan
+        alpha = fit_alpha(num_tail[a_min], log_sum[a_min], a_min)
+        return alpha, a_min, ks_distance(cluster_sizes, a_min, alpha, num_tail[a_min])
+
+    best_alpha, best_a_min, best_distance = nan, 0, nan
+    for candidate in range(1, k):
+        if num_tail[candidate] < min_tail_clusters:
+            break
+        if cluster_sizes[candidate] == 0:
+            continue
+
+        alpha = fit_alpha(num_tail[candidate], log_sum[candidate], candidate)
+        distance = ks_distance(cluster_sizes, candidate, alpha, num_tail[candidate])
+        if isnan(best_distance) or distance < best_distance:
+            best_alpha, best_a_min, best_distance = alpha, candidate, distance
+    return best_alpha, best_a_min, best_distance
+
+
+@njit(parallel=True, cache=True)
+def fit_histogram_batch(histograms, a_min, min_tail_clusters):
+    """ Fits every row of a 2D array of cluster size histograms in parallel """
+    num_histograms = len(histograms)
+    alphas = empty(num_histograms, dtype=float64)
+    a_mins = empty(num_histograms, dtype=int64)
+    distances = empty(num_histograms, dtype=float64)
+
+    for h in prange(num_histograms):
+        alphas[h], a_mins[h], distances[h] = fit_histogram(histograms[h], a_min, min_tail_clusters)
+    return alphas, a_mins, distances
+
+
+@njit(parallel=True, cache=True)
+def bootstrap_alphas(cluster_sizes, num_bootstrap, a_min, min_tail_clusters):
+    """ Refits alpha (including the choice of a_min) to histograms of clusters resampled with replacement """
+    cumulative = cumsum(cluster_sizes[1:])
+    num_clusters = cumulative[-1]
+    alphas = empty(num_bootstrap, dtype=float64)
+
+    for b in prange(num_bootstrap):
+        resampled = zeros(len(cluster_sizes), dtype=int64)
+        for _ in range(num_clusters):
+            resampled[searchsorted(cumulative, random() * num_clusters, side="right") + 1] += 1
+        alphas[b] = fit_histogram(resampled, a_min, min_tail_clusters)[0]
+    return alphas
+
+
+def merge_histograms(histograms):
+    """ Adds up cluster size histograms of different lengths """
+    merged = zeros(max(len(histogram) for histogram in histograms), dtype=int64)
+    for histogram in histograms:
+        merged[:len(histogram)] += histogram
+    return merged
+
+
+def fit_cluster_sizes(cluster_sizes, a_min=0, num_bootstrap=200, confidence=0.95, min_tail_clusters=50):
+    """ Fits a power law to a cluster size histogram by maximum likelihood. Returns beta (= alpha - 1),
+    a_min, the KS distance and the bootstrap confidence interval of beta (num_bootstrap = 0 skips it) """
+    cluster_sizes = array(cluster_sizes, dtype=int64)
+    alpha, a_min_fit, distance = fit_histogram(cluster_sizes, a_min, min_tail_clusters)
+
+    if num_bootstrap == 0 or isnan(alpha):
+        return alpha - 1, a_min_fit, distance, (nan, nan)
+
+    # resamples too small to be fitted are left out of the interval
+    alphas = bootstrap_alphas(cluster_sizes, num_bootstrap, a_min, min_tail_clusters)
+    alphas = alphas[~isnan(alphas)]
+    if len(alphas) == 0:
+        return alpha - 1, a_min_fit, distance, (nan, nan)
+    tail = 50 * (1 - confidence)
+    lower, upper = percentile(alphas - 1, [tail, 100 - tail])
+    return alpha - 1, a_min_fit, distance, (lower, upper)
+
+
+def fit_cluster_sizes_batch(histograms, a_min=0, min_tail_clusters=50):
+    """ Fits beta to many cluster size histograms (e.g. every simulation and time step) in one parallel call
+    Returns arrays of beta, a_min and the KS distance (nan where no fit was possible, see fit_histogram) """
+    padded = zeros((len(histograms), max(len(histogram) for histogram in histograms)), dtype=int64)
+    for h, histogram in enumerate(histograms):
+        padded[h, :len(histogram)] = histogram
+
+    alphas, a_mins, distances = fit_histogram_batch(padded, a_min, min_tail_clusters)
+    return alphas - 1, a_mins, distances
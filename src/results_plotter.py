@@ -1,7 +1,23 @@
 from matplotlib import pyplot as plt
 from numpy import array
 
+from automaton import default_parameters
+from data_manager import load_catalog_series
 from linear_regression import perform_linear_regression
+from sweep import load_sweep_series
+
+
+def load_series(parameter_name, observables, recorded_values):
+    """ Returns the averaged observables vs a parameter from the results of sweep.py, or else from the finished runs
+    of the catalog, preferring whichever covers all of the recorded values. Returns None (keeping the recorded data)
+    if neither has results at two or more values """
+    candidates = [load_sweep_series(parameter_name, observables),
+                  load_catalog_series(parameter_name, observables, default_parameters)]
+    candidates = [series for series in candidates if series is not None]
+    for series in candidates:
+        if set(recorded_values) <= set(series[0]):
+            return series
+    return candidates[0] if len(candidates) > 0 else None
 
 
 def rainfall_vs_forest_cover():
@@ -32,11 +48,15 @@ def rainfall_vs_forest_cover():
 
 def cluster_statistics_vs_rainfall():
     """ Plots number of clusters, cluster size and SD vs rainfall """
-    # This data was obtained from cluster_statistics.py
+    # This data was obtained from cluster_statistics.py, it is replaced by the results of sweep.py
+    # (or else of the catalog) when available
     rainfall = array([300, 400, 500, 600, 700, 800])
     num_clusters = array([10442.2, 16121.8, 18491.2, 17965.4, 15267, 11517])
     average_cluster_size = array([8.17, 6.67, 6.72, 7.76, 10.07, 14.51])
     sd = array([7.77, 7.26, 10.34, 20.8, 48.77, 148.14])
+    series = load_series("rainfall", ["num_clusters", "average_cluster_size", "sd"], rainfall)
+    if series is not None:
+        rainfall, (num_clusters, average_cluster_size, sd), _ = series
 
     plt.title("Number of clusters vs Rainfall")
     plt.xlabel("Rainfall (mm/year)")
@@ -66,8 +86,13 @@ def rainfall_variation():
 
     # this data was obtained from the fitting parameters of the graphs under observations/rainfall_variation
     # fit was performed by fit_power_law function of power_law_graph.py
+    # it is replaced by the results of sweep.py (or else of the catalog) when available
     x = array([300, 400, 500, 600, 700, 800])
     y = array([2.3, 2.22, 1.74, 1.47, 1.17, 1.07])
+    series = load_series("rainfall", ["beta"], x)
+    if series is not None:
+        x, (y,), _ = series
+
     m, c, r_squared = perform_linear_regression(x, y)
 
     print(f"m: {m}")
@@ -85,11 +110,15 @@ def rainfall_variation():
 
 def cluster_statistics_vs_radius():
     """ Plots number of clusters, cluster size and SD vs radius of influence """
-    # This data was obtained from cluster_statistics.py
+    # This data was obtained from cluster_statistics.py, it is replaced by the results of sweep.py
+    # (or else of the catalog) when available
     radius = array([2, 4, 6, 8, 10])
     num_clusters = array([5663.4, 14280.4, 17571.4, 18804, 19820.2])
     average_cluster_size = array([18.59, 7.56, 6.18, 5.79, 5.42])
     sd = array([22.94, 9.09, 6.03, 5.34, 4.93])
+    series = load_series("r_influence", ["num_clusters", "average_cluster_size", "sd"], radius)
+    if series is not None:
+        radius, (num_clusters, average_cluster_size, sd), _ = series
 
     plt.title("Number of clusters vs Radius")
     plt.xlabel("Radius")
@@ -119,8 +148,13 @@ def radius_variation():
 
     # this data was obtained from the fitting parameters of the graphs under observations/radius_variation
     # fit was performed by fit_power_law function of power_law_graph.py
+    # it is replaced by the results of sweep.py (or else of the catalog) when available
     x = array([2, 4, 6, 8, 10])
     y = array([1.83, 1.62, 1.98, 2.84, 2.91])
+    series = load_series("r_influence", ["beta"], x)
+    if series is not None:
+        x, (y,), _ = series
+
     m, c, r_squared = perform_linear_regression(x, y)
 
     print(f"m: {m}")
@@ -138,11 +172,15 @@ def radius_variation():
 
 def cluster_statistics_vs_immediacy():
     """ Plots number of clusters, cluster size and SD vs immediacy """
-    # This data was obtained from cluster_statistics.py
+    # This data was obtained from cluster_statistics.py, it is replaced by the results of sweep.py
+    # (or else of the catalog) when available
     immediacy = array([12, 18, 24, 30, 36])
     num_clusters = array([16115, 16288.8, 15976.8, 16227.2, 16055.6])
     average_cluster_size = array([6.65, 6.58, 6.79, 6.61, 6.73])
     sd = array([6.95, 6.94, 7.18, 7.19, 7.15])
+    series = load_series("immediacy", ["num_clusters", "average_cluster_size", "sd"], immediacy)
+    if series is not None:
+        immediacy, (num_clusters, average_cluster_size, sd), _ = series
 
     plt.title("Number of clusters vs Immediacy")
     plt.xlabel("Immediacy")
@@ -172,8 +210,13 @@ def immediacy_variation():
 
     # this data was obtained from the fitting parameters of the graphs under observations/immediacy_variation
     # fit was performed by fit_power_law function of power_law_graph.py
+    # it is replaced by the results of sweep.py (or else of the catalog) when available
     x = array([12, 18, 24, 30, 36])
     y = array([2.13, 1.88, 1.98, 1.78, 1.92])
+    series = load_series("immediacy", ["beta"], x)
+    if series is not None:
+        x, (y,), _ = series
+
     m, c, r_squared = perform_linear_regression(x, y)
 
     print(f"m: {m}")
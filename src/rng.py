@@ -0,0 +1,29 @@
+# Counter-based random number streams for the automaton and the Ising model
+# Every (seed, step) pair addresses its own Philox stream: the seed sets the key and the step sets the upper
+# half of the 256-bit counter, so the streams of different replicas and steps never overlap, and any of them
+# can be regenerated on its own, in any order and in any process. The compiled kernels consume blocks of
+# uniforms drawn from these streams instead of calling random() for every draw
+
+from numpy import uint64
+from numpy.random import Generator, Philox, SeedSequence
+
+
+def draw_seed():
+    """ Draws a fresh (128 bit) seed from the entropy of the operating system """
+    return SeedSequence().entropy
+
+
+def get_child_seed(seed_sequence):
+    """ Returns a 128 bit seed (as wide as those of draw_seed) drawn from a SeedSequence, e.g. a spawned child """
+    return sum(int(word) << (32 * k) for k, word in enumerate(seed_sequence.generate_state(4)))
+
+
+def get_stream(seed, step):
+    """ Returns the generator of the given step of a seeded run, step -1 being reserved for the initial state """
+    key = SeedSequence(seed).generate_state(2, dtype=uint64)
+    return Generator(Philox(key=key, counter=(step + 1) << 128))
+
+
+def get_uniforms(seed, step, shape):
+    """ Returns a block of uniforms in [0, 1) from the stream of the given step """
+    return get_stream(seed, step).random(shape)
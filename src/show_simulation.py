@@ -1,23 +1,143 @@
+# Plays a simulation from automaton_data, or exports it to a video file without a display
+# Frames are streamed lazily from the trajectory file, so only the frame on screen is kept in memory,
+# and lattices larger than the display are downsampled by averaging blocks of cells (which shows the
+# local forest cover). Playback redraws only the lattice and its time step (blitting), the slider seeks
+# to any time step, space pauses and the arrow keys step through the frames
+
 from matplotlib import pyplot as plt
-from matplotlib.animation import FuncAnimation
+from matplotlib.animation import FFMpegWriter, FuncAnimation, PillowWriter
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from matplotlib.widgets import Slider
+from numpy import float32
+
+from data_manager import open_automaton_data
+
+
+def downsample(lattice, factor):
+    """ Averages factor x factor blocks of cells, cropping the edges that do not fill a whole block """
+    if factor == 1:
+        return lattice
+    n = len(lattice) // factor * factor
+    blocks = lattice[:n, :n].reshape(n // factor, factor, n // factor, factor)
+    return blocks.mean(axis=(1, 3), dtype=float32)
+
+
+class FrameStream:
+    """ Reads the frames of a simulation one at a time, downsampled to at most max_resolution cells per side """
+
+    def __init__(self, num_file, max_resolution=512):
+        self.trajectory = open_automaton_data(num_file)
+        self.factor = -(-self.trajectory.n // max_resolution)
+
+    def __len__(self):
+        return len(self.trajectory)
+
+    def read_frame(self, time_step):
+        return downsample(self.trajectory.read_frame(time_step), self.factor)
+
+    def close(self):
+        self.trajectory.close()
+
+
+class Player:
+    """ Interactive playback of a frame stream, every stride-th frame from start on """
+
+    def __init__(self, frames, interval=100, stride=1, start=0):
+        self.frames = frames
+        self.stride = stride
+        self.time_step = start
+        self.shown_time_step = None
+        self.paused = False
+
+        self.figure = plt.figure()
+        axes = self.figure.add_axes([0.05, 0.12, 0.9, 0.83])
+        axes.set_axis_off()
+        self.image = axes.imshow(frames.read_frame(start), vmin=0, vmax=1, interpolation="nearest", animated=True)
+        self.label = axes.text(0.01, 0.99, "", transform=axes.transAxes, verticalalignment="top",
+                               backgroundcolor="white", animated=True)
 
-from data_manager import load_automaton_data
+        # the slider is only used for seeking, moving it on every frame would redraw the whole figure
+        slider_axes = self.figure.add_axes([0.15, 0.03, 0.7, 0.04])
+        self.slider = Slider(slider_axes, "Time", 0, len(frames) - 1, valinit=start, valstep=1)
+        self.slider.on_changed(self.seek)
+        self.figure.canvas.mpl_connect("key_press_event", self.on_key)
+
+        self.animation = FuncAnimation(self.figure, self.update, frames=self.advance, interval=interval, blit=True,
+                                       cache_frame_data=False)
+
+    def advance(self):
+        """ Yields the time step to be shown on every tick, moving on only once the current one was shown
+        (so that a time step set by seeking is not skipped), and stopping at the last frame """
+        while True:
+            if not self.paused and self.time_step == self.shown_time_step:
+                self.time_step = min(self.time_step + self.stride, len(self.frames) - 1)
+            yield self.time_step
+
+    def update(self, time_step):
+        if time_step != self.shown_time_step:
+            self.image.set_data(self.frames.read_frame(time_step))
+            self.label.set_text(f"t = {time_step}")
+            self.shown_time_step = time_step
+        return [self.image, self.label]
+
+    def seek(self, time_step):
+        self.time_step = int(time_step)
+
+    def on_key(self, event):
+        if event.key == " ":
+            self.paused = not self.paused
+        elif event.key in ["left", "right"]:
+            self.paused = True
+            step = self.stride if event.key == "right" else -self.stride
+            self.time_step = min(max(self.time_step + step, 0), len(self.frames) - 1)
+
+
+def export_video(frames, path, frames_per_second=10, stride=1, start=0, stop=None):
+    """ Renders every stride-th frame in [start, stop) to a video file, drawing without a display and passing
+    each frame to the writer as soon as it is drawn. GIFs are written by Pillow (which keeps all frames until
+    the end), every other format is encoded by ffmpeg """
+    first_frame = frames.read_frame(start)
+
+    # one pixel per (downsampled) cell, with an even size as required by most video codecs
+    size = (len(first_frame) + 1) // 2 * 2
+    figure = Figure(figsize=(size / 100, size / 100))
+    FigureCanvasAgg(figure)
+    axes = figure.add_axes([0, 0, 1, 1])
+    axes.set_axis_off()
+    image = axes.imshow(first_frame, vmin=0, vmax=1, interpolation="nearest")
+    label = axes.text(0.01, 0.99, "", transform=axes.transAxes, verticalalignment="top", backgroundcolor="white")
+
+    writer = PillowWriter(fps=frames_per_second) if path.endswith(".gif") else FFMpegWriter(fps=frames_per_second)
+    time_steps = range(len(frames))[start:stop:stride]
+
+    with writer.saving(figure, path, dpi=100):
+        for k, time_step in enumerate(time_steps):
+            print(f"Frame {k + 1} / {len(time_steps)}", end="\r")
+            image.set_data(frames.read_frame(time_step))
+            label.set_text(f"t = {time_step}")
+            writer.grab_frame()
+    print(f"Video written to {path}")
 
-def animate(i):
-    im.set_array(lattice_record[i])
-    return [im]
 
 if __name__ == '__main__':
-    # simulation from automaton_data that needs to be played
+    # simulation from automaton_data that needs to be played (older pickled simulations need to be
+    # converted to trajectories with data_manager.py first)
     simulation_index = int(input("Enter simulation index: "))
-    lattice_record = load_automaton_data(simulation_index)
-    num_frames = len(lattice_record)
-
-    fig = plt.figure()
-    im = plt.imshow(lattice_record[0])
-    animate = FuncAnimation(fig,
-                                animate,
-                                frames=num_frames,
-                                interval=100,
-                                repeat=False)
-    plt.show()
\ No newline at end of file
+
+    # lattices larger than max_resolution are downsampled, every stride-th frame is shown from start_step on
+    max_resolution = 512
+    stride = 1
+    start_step = 0
+
+    # set to a file name (e.g. "simulation.mp4" or "simulation.gif") to export a video instead of playing
+    export_path = None
+    frames_per_second = 10
+
+    frames = FrameStream(simulation_index, max_resolution)
+    if export_path is None:
+        player = Player(frames, interval=100, stride=stride, start=start_step)
+        plt.show()
+    else:
+        export_video(frames, export_path, frames_per_second, stride, start_step)
+    frames.close()
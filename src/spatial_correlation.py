@@ -0,0 +1,189 @@
+# Spatial correlations of the vegetation lattice with time: the two-point correlation function C(r), the radially
+# averaged structure factor S(k) and the correlation length (where C(r) falls below 1/e)
+# Both are calculated by FFTs over batches of frames, read from the trajectory of every simulation in chunks that
+# fit into max_memory bytes, so that memory does not grow with the length of a simulation. Simulations are
+# processed by their own processes, and the results are averaged over the ensemble at every time step
+
+from concurrent.futures import ProcessPoolExecutor
+from json import dump
+from math import exp, pi
+from numpy import arange, array, bincount, concatenate, float64, hypot, isnan, maximum, nan, nanmean, rint, stack
+from numpy.fft import fft2, fftfreq, irfft2, rfft2
+import os
+
+from cluster import limit_worker_threads
+from data_manager import find_runs, get_common_time_steps, load_automaton_frames
+from time_series_analysis import get_standard_error
+
+
+def get_radial_bins(size):
+    """ Returns the (rounded) distance of every element of a size x size FFT grid from the origin, counting
+    wrapped indices as negative """
+    indices = rint(fftfreq(size) * size)
+    return rint(hypot(indices[:, None], indices[None, :])).astype(int).ravel()
+
+
+def radial_average(values, bins, num_bins):
+    """ Averages every (flattened) frame of values over the elements of each bin below num_bins """
+    inside = bins < num_bins
+    num_frames = len(values)
+    frame_bins = (arange(num_frames)[:, None] * num_bins + bins[inside][None, :]).ravel()
+    sums = bincount(frame_bins, weights=values.reshape(num_frames, -1)[:, inside].ravel(),
+                    minlength=num_frames * num_bins).reshape(num_frames, num_bins)
+    return sums / bincount(bins[inside], minlength=num_bins)
+
+
+def correlate_frames(frames, max_distance):
+    """ Returns C(r) for r = 0 ... max_distance and S(k) for |k| = 0 ... n / 2 (in units of 2 pi / n) of every frame
+    of a (T, n, n) stack. The lattice has open boundaries, so C(r) is calculated from zero-padded FFTs, each
+    displacement being normalized by the number of pairs of cells it joins """
+    num_frames, n = len(frames), frames.shape[-1]
+    fluctuations = frames.astype(float64)
+    fluctuations -= fluctuations.mean(axis=(1, 2), keepdims=True)
+    variances = (fluctuations ** 2).mean(axis=(1, 2))
+
+    power = abs(fft2(fluctuations)) ** 2 / (n * n)
+    structure_factor = radial_average(power, get_radial_bins(n), n // 2 + 1)
+    del power
+
+    padded_power = abs(rfft2(fluctuations, s=(2 * n, 2 * n))) ** 2
+    covariance = irfft2(padded_power, s=(2 * n, 2 * n))
+    del padded_power
+
+    # number of pairs of cells (within the lattice) at every displacement, displacements of n join none
+    overlaps = maximum(n - abs(rint(fftfreq(2 * n) * 2 * n)), 1)
+    covariance /= overlaps[:, None] * overlaps[None, :]
+    correlation = radial_average(covariance, get_radial_bins(2 * n), min(max_distance, n - 1) + 1)
+
+    # empty or fully covered lattices have no fluctuations to correlate
+    variances[variances == 0] = nan
+    return correlation / variances[:, None], structure_factor
+
+
+def get_correlation_length(correlation):
+    """ Returns the distance at which C(r) first falls below 1/e (interpolated linearly), nan if it does not """
+    below = (correlation < exp(-1)).nonzero()[0]
+    if len(below) == 0 or isnan(correlation[0]):
+        return nan
+    r = below[0]
+    return r - 1 + (correlation[r - 1] - exp(-1)) / (correlation[r - 1] - correlation[r])
+
+
+def get_batch_size(n, max_memory):
+    """ Returns the number of frames whose FFTs fit into max_memory bytes (the padded FFT and its inverse take
+    about 64 n^2 bytes per frame) """
+    return max(max_memory // (64 * n * n), 1)
+
+
+def correlate_simulation(simulation_index, time_indices, max_distance=None, max_memory=2 ** 28):
+    """ Returns C(r), S(k) and the correlation length of a simulation at the given (increasing) time indices,
+    reading the file once. max_distance defaults to half of the lattice """
+    correlations, structure_factors = [], []
+    start, batch_size = 0, 1
+
+    while start < len(time_indices):
+        frames = load_automaton_frames(simulation_index, time_indices[start:start + batch_size])
+        n = frames.shape[-1]
+        if max_distance is None:
+            max_distance = n // 2
+
+        correlation, structure_factor = correlate_frames(frames, max_distance)
+        correlations.append(correlation)
+        structure_factors.append(structure_factor)
+
+        # the first frame tells the lattice size, and hence the number of frames per batch
+        start += len(frames)
+        batch_size = get_batch_size(n, max_memory)
+
+    correlation = concatenate(correlations)
+    structure_factor = concatenate(structure_factors)
+    correlation_length = array([get_correlation_length(row) for row in correlation])
+    return correlation, structure_factor, correlation_length
+
+
+def analyse_spatial_correlations(simulation_indices, time_indices, num_workers=None, max_distance=None,
+                                 max_memory=2 ** 28):
+    """ Calculates the ensemble averages of C(r), S(k) and the correlation length at every time index, with the
+    standard error of the correlation length. max_memory bounds the memory of every process, num_workers = 1
+    processes all simulations in this process. Time indices past the shortest simulation are dropped """
+    time_indices = get_common_time_steps(simulation_indices, time_indices)
+    arguments = [simulation_indices, [time_indices] * len(simulation_indices),
+                 [max_distance] * len(simulation_indices), [max_memory] * len(simulation_indices)]
+    if num_workers == 1:
+        simulation_results = list(map(correlate_simulation, *arguments))
+    else:
+        with ProcessPoolExecutor(num_workers, initializer=limit_worker_threads) as pool:
+            simulation_results = list(pool.map(correlate_simulation, *arguments))
+
+    if len({result[1].shape for result in simulation_results}) > 1:
+        raise ValueError("The simulations have different lattice sizes")
+    correlations, structure_factors, correlation_lengths = (stack(values) for values in zip(*simulation_results))
+    n = 2 * (structure_factors.shape[-1] - 1)
+
+    return {
+        "simulation_indices": list(simulation_indices),
+        "time_indices": list(time_indices),
+        "distances": list(range(correlations.shape[-1])),
+        "wavenumbers": [2 * pi * k / n for k in range(structure_factors.shape[-1])],
+        "correlation": nanmean(correlations, axis=0).tolist(),
+        "structure_factor": structure_factors.mean(axis=0).tolist(),
+        "correlation_length": nanmean(correlation_lengths, axis=0).tolist(),
+        "correlation_length_error": [get_standard_error(lengths[~isnan(lengths)]) if (~isnan(lengths)).sum() > 1
+                                     else nan for lengths in correlation_lengths.T],
+    }
+
+
+def save_spatial_correlations(results, path):
+    with open(path, "w") as file:
+        dump(results, file, indent=4)
+    print(f"Results written to {path}")
+
+
+def plot_spatial_correlations(results, num_curves=5):
+    """ Plots C(r) and S(k) at num_curves time indices, and the correlation length against time """
+    from matplotlib import pyplot as plt
+    time_indices = results["time_indices"]
+    shown = range(0, len(time_indices), max(len(time_indices) // num_curves, 1))
+
+    plt.title("Two-point correlation function")
+    plt.xlabel("r")
+    plt.ylabel("C(r)")
+    for t in shown:
+        plt.plot(results["distances"], results["correlation"][t], label=f"t = {time_indices[t]}")
+    plt.legend()
+    plt.show()
+
+    plt.title("Radially averaged structure factor")
+    plt.xlabel("k")
+    plt.ylabel("S(k)")
+    for t in shown:
+        plt.loglog(results["wavenumbers"][1:], results["structure_factor"][t][1:], label=f"t = {time_indices[t]}")
+    plt.legend()
+    plt.show()
+
+    plt.title("Variation of correlation length with time")
+    plt.xlabel("Time")
+    plt.ylabel("Correlation length")
+    plt.errorbar(time_indices, results["correlation_length"], yerr=results["correlation_length_error"], capsize=2)
+    plt.show()
+
+
+if __name__ == '__main__':
+    # simulations to be considered from automaton_data, selected from the catalog by their parameters
+    # (e.g. {"rainfall": 600, "n": 500}), all of the same lattice size
+    selection = {}
+    simulation_indices = find_runs(**selection)
+
+    # times at which the correlations are calculated
+    time_indices = list(range(0, 200, 10))
+
+    # None uses one process per core, 1 runs in this process. Every process reads and transforms as many
+    # frames at once as fit into max_memory bytes
+    num_workers = None
+    max_memory = 2 ** 28
+
+    print(f"Processing {len(simulation_indices)} simulations at {len(time_indices)} time steps ...")
+    results = analyse_spatial_correlations(simulation_indices, time_indices, num_workers, max_memory=max_memory)
+
+    save_spatial_correlations(results, os.path.join(os.path.dirname(__file__), "spatial_correlation_results.json"))
+    plot_spatial_correlations(results)
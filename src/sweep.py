@@ -0,0 +1,168 @@
+# Sweeps the automaton over a grid of parameters (rainfall, r_influence, immediacy, n, ...)
+# Every (parameter point, replica) job is scheduled on a process pool, and its result is
+# stored under sweep_data, so that finished jobs are skipped when the sweep is rerun
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import product
+from json import dump, load
+from numpy import array, mean, std
+from numpy.random import SeedSequence
+from zlib import crc32
+import os
+
+from automaton import default_parameters, simulate
+from cluster_statistics import obtain_observables
+from observers import EquilibrationObserver, ForestCoverObserver, SnapshotObserver
+from rng import get_child_seed
+
+
+def get_sweep_path(*names):
+    """ Returns a path inside the sweep_data folder """
+    current_path = os.path.dirname(__file__)
+    return os.path.join(current_path, "sweep_data", *names)
+
+
+def make_parameter_grid(base_parameters, **sweep_values):
+    """ Returns a list of parameter sets, one for every combination of the swept values """
+    names = list(sweep_values.keys())
+    grid = []
+
+    for values in product(*sweep_values.values()):
+        parameters = base_parameters.copy()
+        parameters.update(zip(names, values))
+        grid.append(parameters)
+    return grid
+
+
+def get_point_name(parameters):
+    """ Returns a unique, human-readable name for a parameter point """
+    return "_".join(f"{name}={parameters[name]}" for name in sorted(parameters))
+
+
+def get_replica_seed(seed, parameters, replica):
+    """ Returns a seed for a (parameter point, replica) job that does not depend on the rest of the grid """
+    point_hash = crc32(get_point_name(parameters).encode())
+    return get_child_seed(SeedSequence([seed, point_hash, replica]))
+
+
+def is_job_finished(parameters, replica):
+    """ Checks whether the result of a (parameter point, replica) job is already stored """
+    return os.path.exists(get_sweep_path(get_point_name(parameters), f"replica_{replica}.json"))
+
+
+def run_sweep_job(parameters, replica, seed, num_samples=None):
+    """ Simulates a single replica of a parameter point and calculates its observables, stopping early once it
+    holds num_samples decorrelated samples after equilibrating (None runs all mc_steps) """
+    forest_cover_observer = ForestCoverObserver()
+    snapshot_observer = SnapshotObserver(stride=parameters["mc_steps"])
+    equilibration_observer = EquilibrationObserver(num_samples)
+    simulate(parameters, seed, observers=[forest_cover_observer, snapshot_observer, equilibration_observer])
+
+    return {
+        "replica": replica,
+        "seed": seed,
+        "forest_cover": [float(forest_cover) for forest_cover in forest_cover_observer.forest_cover],
+        **obtain_observables(snapshot_observer.final_lattice),
+        **equilibration_observer.get_statistics(),
+    }
+
+
+def save_job_result(parameters, result):
+    """ Stores the result of a job, writing to a temporary file first so that partial results are never read """
+    point_path = get_sweep_path(get_point_name(parameters))
+    os.makedirs(point_path, exist_ok=True)
+
+    parameters_path = os.path.join(point_path, "parameters.json")
+    if not os.path.exists(parameters_path):
+        with open(parameters_path, "w") as file:
+            dump(parameters, file, indent=4)
+
+    result_path = os.path.join(point_path, f"replica_{result['replica']}.json")
+    with open(result_path + ".tmp", "w") as file:
+        dump(result, file)
+    os.replace(result_path + ".tmp", result_path)
+
+
+def run_sweep(grid, num_replicas, num_workers=None, seed=0, num_samples=None):
+    """ Runs every unfinished (parameter point, replica) job of the grid on a process pool, every job stopping
+    early once it holds num_samples decorrelated samples after equilibrating (None runs all mc_steps) """
+    jobs = [(parameters, replica) for parameters in grid for replica in range(num_replicas)
+            if not is_job_finished(parameters, replica)]
+    print(f"{len(grid) * num_replicas - len(jobs)} / {len(grid) * num_replicas} jobs already finished")
+
+    # worker processes are reused between jobs, so every kernel is compiled once per worker
+    # (the parameters are arguments of the kernels, not compile-time constants)
+    with ProcessPoolExecutor(num_workers) as pool:
+        futures = {pool.submit(run_sweep_job, parameters, replica, get_replica_seed(seed, parameters, replica),
+                               num_samples): parameters
+                   for parameters, replica in jobs}
+
+        for num_finished, future in enumerate(as_completed(futures), start=1):
+            parameters = futures[future]
+            result = future.result()
+            save_job_result(parameters, result)
+            print(f"Job {num_finished} / {len(jobs)} finished: {get_point_name(parameters)}, replica {result['replica']}")
+            if num_samples is not None and not result["equilibrated"]:
+                print(f"    Not equilibrated after {result['num_steps']} steps")
+
+
+def load_sweep_point(point_name):
+    """ Loads the parameters and all finished replica results of a parameter point """
+    point_path = get_sweep_path(point_name)
+    with open(os.path.join(point_path, "parameters.json")) as file:
+        parameters = load(file)
+
+    results = []
+    for file_name in sorted(os.listdir(point_path)):
+        if file_name.startswith("replica_") and file_name.endswith(".json"):
+            with open(os.path.join(point_path, file_name)) as file:
+                results.append(load(file))
+    return parameters, results
+
+
+def load_sweep_series(parameter_name, observables, base_parameters=default_parameters, min_points=2):
+    """ Returns the values of a swept parameter and the replica-averaged observables (with their SDs) at each value,
+    considering only points whose other parameters equal base_parameters. Returns None if fewer than min_points
+    values were found (the default point of a sweep over another parameter alone is no series) """
+    if not os.path.exists(get_sweep_path()):
+        return None
+
+    points = {}
+    for point_name in os.listdir(get_sweep_path()):
+        parameters, results = load_sweep_point(point_name)
+        other_parameters_match = all(parameters[name] == value for name, value in base_parameters.items()
+                                     if name != parameter_name)
+        if other_parameters_match and len(results) > 0:
+            points[parameters[parameter_name]] = results
+
+    if len(points) < min_points:
+        return None
+
+    values = sorted(points)
+    means = [array([mean([result[observable] for result in points[value]]) for value in values])
+             for observable in observables]
+    sds = [array([std([result[observable] for result in points[value]]) for value in values])
+           for observable in observables]
+    return array(values), means, sds
+
+
+if __name__ == '__main__':
+    num_replicas = 5
+
+    # None uses all cores
+    num_workers = None
+    seed = 0
+
+    # with num_samples, every job stops once it holds that many decorrelated samples after equilibrating
+    # (mc_steps is then only an upper limit), None always runs mc_steps
+    num_samples = None
+
+    grid = make_parameter_grid(default_parameters, rainfall=[300, 400, 500, 600, 700, 800])
+    grid += make_parameter_grid(default_parameters, r_influence=[2, 4, 6, 8, 10])
+    grid += make_parameter_grid(default_parameters, immediacy=[12, 18, 24, 30, 36])
+
+    # the default point appears in all three sweeps, so duplicates are removed
+    grid = list({get_point_name(parameters): parameters for parameters in grid}.values())
+
+    print("Loading compiled functions (they are only compiled on the first run, which takes a few seconds ...)")
+    run_sweep(grid, num_replicas, num_workers, seed, num_samples)
@@ -1,54 +1,106 @@
-from matplotlib import pyplot as plt
-from numpy import log, pad, zeros
+# Evolution of the power-law exponent of the cluster size distribution with time
+# Every simulation file is read once, in a single pass over the sampled time steps, by its own process.
+# The cluster size histograms are then pooled over the ensemble at every time step
 
-from power_law import fit_power_law, get_probabilities, trim_log_probabilities
+from concurrent.futures import ProcessPoolExecutor
+from json import dump
+from numpy import isnan, mean, nan, sqrt, std
+import os
 
-if __name__ == '__main__':
-    # simulations to be considered from automaton_data
-    simulation_indices = list(range(0, 10))
+from cluster import limit_worker_threads
+from cluster_cache import cluster_cache
+from data_manager import find_runs, get_common_time_steps
+from power_law import fit_probabilities, get_cluster_probabilities
+from power_law_mle import fit_cluster_sizes_batch, merge_histograms
+
+
+def extract_cluster_sizes(simulation_index, time_indices, batch_size=16):
+    """ Returns the cluster size histogram of a simulation at every time index, from the cluster cache, so that
+    reruns (e.g. for a different fit window) do not label the frames again. The frames that are not cached are
+    read in a single pass over the file, and labeled batch_size at a time in parallel """
+    return cluster_cache.get_cluster_sizes_batch(simulation_index, time_indices, batch_size=batch_size)
 
-    # times at which the lattice will be sampled for clustering
-    time_indices = list(range(0, 200, 10))
 
-    beta_time_series = []
-    r_squared_time_series = []
+def get_standard_error(values):
+    """ Returns the standard error of the mean of the given values """
+    return float(std(values) / sqrt(len(values)))
 
-    for i, time in enumerate(time_indices):
-        print(f"At time step {i + 1} / {len(time_indices)}:")
 
-        ensemble_probabilities = []
+def analyse_time_series(simulation_indices, time_indices, num_workers=None):
+    """ Calculates beta(t) and R^2(t) of the pooled ensemble distribution, with the standard errors of the
+    per-simulation fits, and the maximum likelihood beta(t). Time indices past the shortest simulation are dropped """
+    time_indices = get_common_time_steps(simulation_indices, time_indices)
+    with ProcessPoolExecutor(num_workers, initializer=limit_worker_threads) as pool:
+        simulation_cluster_sizes = list(pool.map(extract_cluster_sizes, simulation_indices,
+                                                 [time_indices] * len(simulation_indices)))
 
-        for i, simulation_index in enumerate(simulation_indices):
-            print(f"    Lattice {i + 1} / {len(simulation_indices)} being processed")
-            probabilities = get_probabilities(simulation_index, time)
-            ensemble_probabilities.append(probabilities)
+    results = {"simulation_indices": list(simulation_indices), "time_indices": list(time_indices),
+               "beta": [], "beta_error": [], "r_squared": [], "r_squared_error": [],
+               "mle_beta": [], "mle_beta_error": []}
 
-        max_length = max([len(probabilities) for probabilities in ensemble_probabilities])
-        averaged_probability = zeros(max_length, dtype=float)
+    for t in range(len(time_indices)):
+        histograms = [cluster_sizes[t] for cluster_sizes in simulation_cluster_sizes]
+        beta, _, r_squared = fit_probabilities(get_cluster_probabilities(merge_histograms(histograms)))
+        simulation_fits = [fit_probabilities(get_cluster_probabilities(histogram)) for histogram in histograms]
+        mle_betas, _, _ = fit_cluster_sizes_batch(histograms)
 
-        for probabilities in ensemble_probabilities:
-            padded_probabilities = pad(probabilities, (0, max_length - len(probabilities)), mode="constant", constant_values=0)
-            averaged_probability += padded_probabilities
+        # simulations with too few clusters for either fit are left out
+        simulation_fits = [fit for fit in simulation_fits if not isnan(fit[0])]
+        mle_betas = mle_betas[~isnan(mle_betas)]
 
-        averaged_probability /= len(ensemble_probabilities)
+        results["beta"].append(float(beta))
+        results["beta_error"].append(get_standard_error([fit[0] for fit in simulation_fits])
+                                     if len(simulation_fits) > 0 else nan)
+        results["r_squared"].append(float(r_squared))
+        results["r_squared_error"].append(get_standard_error([fit[2] for fit in simulation_fits])
+                                          if len(simulation_fits) > 0 else nan)
+        results["mle_beta"].append(float(mean(mle_betas)) if len(mle_betas) > 0 else nan)
+        results["mle_beta_error"].append(get_standard_error(mle_betas) if len(mle_betas) > 0 else nan)
 
-        log_probabilities = trim_log_probabilities(log(probabilities))
-        log_areas = log(range(1, len(log_probabilities) + 1))
+    return results
 
-        beta, c, r_squared = fit_power_law(log_areas, log_probabilities)
-        beta *= -1
-        
-        beta_time_series.append(beta)
-        r_squared_time_series.append(r_squared)
+
+def save_time_series(results, path):
+    with open(path, "w") as file:
+        dump(results, file, indent=4)
+    print(f"Results written to {path}")
+
+
+def plot_time_series(results):
+    """ Plots beta(t) of both fits and R^2(t), with their standard errors """
+    from matplotlib import pyplot as plt
+    time_indices = results["time_indices"]
 
     plt.title("Variation of power-law exponent with time")
     plt.xlabel("Time")
     plt.ylabel("Power-law exponent")
-    plt.plot(time_indices, beta_time_series)
+    plt.errorbar(time_indices, results["beta"], yerr=results["beta_error"], capsize=2)
+    plt.errorbar(time_indices, results["mle_beta"], yerr=results["mle_beta_error"], capsize=2)
+    plt.legend(["Least squares fit", "Maximum likelihood fit"])
     plt.show()
 
     plt.title("Variation of R-squared with time")
     plt.xlabel("Time")
     plt.ylabel("R-squared")
-    plt.plot(time_indices, r_squared_time_series)
-    plt.show()
\ No newline at end of file
+    plt.errorbar(time_indices, results["r_squared"], yerr=results["r_squared_error"], capsize=2)
+    plt.show()
+
+
+if __name__ == '__main__':
+    # simulations to be considered from automaton_data, selected from the catalog by their parameters
+    # (e.g. {"rainfall": 600, "n": 500}). Runs of older versions have no recorded parameters, and are
+    # only selected without any
+    selection = {}
+    simulation_indices = find_runs(**selection)
+
+    # times at which the lattice will be sampled for clustering
+    time_indices = list(range(0, 200, 10))
+
+    # None uses one process per core
+    num_workers = None
+
+    print(f"Processing {len(simulation_indices)} simulations at {len(time_indices)} time steps ...")
+    results = analyse_time_series(simulation_indices, time_indices, num_workers)
+
+    save_time_series(results, os.path.join(os.path.dirname(__file__), "time_series_results.json"))
+    plot_time_series(results)
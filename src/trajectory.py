@@ -0,0 +1,220 @@
+# Compact on-disk format for automaton trajectories
+#
+# Every frame is bit-packed (1 bit per cell) and frames are grouped into chunks. Inside a chunk the
+# first frame is a keyframe and, optionally, every later frame is stored as the XOR (flips) with the
+# previous frame, which compresses very well since only a few cells flip per step. Chunks are
+# compressed independently, and an index of chunk offsets is stored at the end of the file, so any
+# frame or strided range is read through a memory map by decoding only the chunks that contain it.
+#
+# Layout: header | chunk 0 | chunk 1 | ... | index (offset, length of every chunk)
+
+from mmap import ACCESS_READ, mmap
+from numpy import bitwise_xor, frombuffer, packbits, uint8, uint64, unpackbits, zeros
+from pickle import load
+from struct import calcsize, pack, unpack
+from zlib import compress, decompress
+import os
+
+MAGIC = b"VEGTRAJ1"
+HEADER_FORMAT = "<8sIIQIIIQ"
+HEADER_SIZE = calcsize(HEADER_FORMAT)
+
+FLAG_DELTA = 1
+
+
+class TrajectoryWriter:
+    """ Appends frames of an n x n lattice to a trajectory file """
+
+    def __init__(self, path, n, frames_per_chunk=20, compression_level=6, delta=True):
+        self.path = path
+        self.n = n
+        self.frames_per_chunk = frames_per_chunk
+        self.compression_level = compression_level
+        self.flags = FLAG_DELTA if delta else 0
+
+        self.num_frames = 0
+        self.chunk_index = []
+        self.chunk_frames = []
+        self.previous_frame = None
+
+        self.file = open(path, "wb")
+        self.write_header(index_offset=0)
+
+    def write_header(self, index_offset):
+        self.file.seek(0)
+        self.file.write(pack(HEADER_FORMAT, MAGIC, 1, self.n, self.num_frames, self.frames_per_chunk,
+                             self.flags, self.compression_level, index_offset))
+
+    def write_frame(self, lattice):
+        """ Bit-packs a lattice (of 0 and 1) and appends it to the current chunk """
+        frame = packbits(lattice.reshape(-1))
+
+        if self.flags & FLAG_DELTA and len(self.chunk_frames) > 0:
+            self.chunk_frames.append(bitwise_xor(frame, self.previous_frame))
+        else:
+            self.chunk_frames.append(frame)
+        self.previous_frame = frame
+        self.num_frames += 1
+
+        if len(self.chunk_frames) == self.frames_per_chunk:
+            self.flush_chunk()
+
+    def flush_chunk(self):
+        if len(self.chunk_frames) == 0:
+            return
+        if self.file is None:
+            self.reopen()
+
+        payload = b"".join(frame.tobytes() for frame in self.chunk_frames)
+        if self.compression_level > 0:
+            payload = compress(payload, self.compression_level)
+
+        self.chunk_index.append((self.file.tell(), len(payload)))
+        self.file.write(payload)
+        self.chunk_frames = []
+
+    def close(self):
+        """ Writes the last chunk and the index, after which the trajectory can be read """
+        self.flush_chunk()
+        if self.file is None:
+            self.reopen()
+        index_offset = self.file.tell()
+        for offset, length in self.chunk_index:
+            self.file.write(pack("<QQ", offset, length))
+
+        self.write_header(index_offset)
+        self.file.close()
+
+    def __getstate__(self):
+        """ Pickles the writer (for checkpoints) without its file, which is flushed to disk """
+        state = self.__dict__.copy()
+        if self.file is not None:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            state["offset"] = self.file.tell()
+        del state["file"]
+        return state
+
+    def __setstate__(self, state):
+        """ Restores the writer without touching its file, which is only reopened once the writer writes again,
+        so that loading a checkpoint (e.g. to read its parameters) has no effect on the trajectory """
+        self.__dict__.update(state)
+        self.file = None
+
+    def reopen(self):
+        """ Reopens the file at the pickled position, discarding whatever was written after it """
+        self.file = open(self.path, "r+b")
+        self.file.truncate(self.offset)
+        self.file.seek(self.offset)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class TrajectoryReader:
+    """ Reads single frames or ranges of frames from a trajectory file through a memory map """
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.map = mmap(self.file.fileno(), 0, access=ACCESS_READ)
+
+        magic, _, self.n, self.num_frames, self.frames_per_chunk, self.flags, self.compression_level, index_offset = \
+            unpack(HEADER_FORMAT, self.map[:HEADER_SIZE])
+        if magic != MAGIC:
+            raise ValueError("Invalid trajectory file")
+
+        num_chunks = -(-self.num_frames // self.frames_per_chunk)
+        self.chunk_index = frombuffer(self.map, dtype=uint64, count=2 * num_chunks, offset=index_offset).reshape(-1, 2)
+        self.frame_bytes = -(-self.n * self.n // 8)
+
+        # number of (compressed) bytes read from the file so far
+        self.bytes_read = HEADER_SIZE + self.chunk_index.nbytes
+
+        # the last chunk decoded by read_frame, so that consecutive frames are decoded once per chunk
+        self.cached_chunk = -1
+        self.cached_frames = None
+
+    def __len__(self):
+        return self.num_frames
+
+    def read_chunk(self, chunk):
+        """ Returns the packed (keyframe-decoded) frames of a chunk """
+        offset, length = (int(value) for value in self.chunk_index[chunk])
+        self.bytes_read += length
+
+        if self.compression_level > 0:
+            payload = decompress(self.map[offset:offset + length])
+        else:
+            payload = memoryview(self.map)[offset:offset + length]
+        frames = frombuffer(payload, dtype=uint8).reshape(-1, self.frame_bytes)
+
+        if self.flags & FLAG_DELTA:
+            frames = bitwise_xor.accumulate(frames, axis=0)
+        return frames
+
+    def unpack_frame(self, frame):
+        return unpackbits(frame, count=self.n * self.n).reshape(self.n, self.n)
+
+    def read_frame(self, time_step):
+        """ Reads the (uint8) lattice at a single time step (negative steps count from the end) """
+        if time_step < 0:
+            time_step += self.num_frames
+        if not 0 <= time_step < self.num_frames:
+            raise IndexError("Time step out of range")
+
+        chunk, position = divmod(time_step, self.frames_per_chunk)
+        if chunk != self.cached_chunk:
+            self.cached_frames = self.read_chunk(chunk)
+            self.cached_chunk = chunk
+        return self.unpack_frame(self.cached_frames[position])
+
+    def read_frames(self, start=0, stop=None, step=1):
+        """ Reads the lattices at time steps range(start, stop, step), decoding every chunk at most once """
+        return self.read_time_steps(range(self.num_frames)[start:stop:step])
+
+    def read_time_steps(self, time_steps):
+        """ Reads the lattices at the given (increasing) time steps, decoding every chunk at most once
+        (negative steps count from the end) """
+        frames = zeros((len(time_steps), self.n, self.n), dtype=uint8)
+
+        chunk, packed_frames = -1, None
+        for k, time_step in enumerate(time_steps):
+            if time_step < 0:
+                time_step += self.num_frames
+            if not 0 <= time_step < self.num_frames:
+                raise IndexError("Time step out of range")
+
+            if time_step // self.frames_per_chunk != chunk:
+                chunk = time_step // self.frames_per_chunk
+                packed_frames = self.read_chunk(chunk)
+            frames[k] = self.unpack_frame(packed_frames[time_step % self.frames_per_chunk])
+        return frames
+
+    def close(self):
+        self.chunk_index = None
+        self.cached_frames = None
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def write_trajectory(path, lattice_record, **options):
+    """ Writes a whole lattice record to a trajectory file """
+    with TrajectoryWriter(path, len(lattice_record[0]), **options) as writer:
+        for lattice in lattice_record:
+            writer.write_frame(lattice)
+
+
+def convert_pickle_file(pickle_path, trajectory_path, **options):
+    """ Converts a pickled (mc_steps, n, n) lattice record to the trajectory format """
+    with open(pickle_path, "rb") as file:
+        lattice_record = load(file)
+    write_trajectory(trajectory_path, lattice_record, **options)